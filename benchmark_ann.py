@@ -0,0 +1,87 @@
+import argparse
+import numpy as np
+import time
+
+from features.ann import IVFIndex, hellinger_embedding, top_k
+
+# Measures recall against exact search, and query latency, of the IVF index
+# (see features/ann.py) for a range of nprobe.
+#
+# Queries are held-out webcams; recall@k is the fraction of their exact k
+# nearest webcams that the index returns. Without a webcams.npz, random
+# histograms are used (--synthetic webcams, --words words each).
+#
+# Usage Example:
+#   benchmark_ann.py --webcams features_out/webcams.npz --lists 128 -k 10
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--webcams", help="webcams.npz written by compute_features.py")
+  parser.add_argument("--synthetic", type=int, default=20000,
+      help="Number of random histograms used without --webcams")
+  parser.add_argument("--words", type=int, default=300,
+      help="Number of words of the random histograms")
+  parser.add_argument("--lists", type=int, default=128, help="Number of inverted lists")
+  parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+  parser.add_argument("-k", type=int, default=10, help="Number of neighbors")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  return args
+
+# Random histograms, each a mix of two of a few hundred prototype scenes, so
+# that they have neighbors like real webcams do without forming clean
+# clusters.
+def synthetic_histograms(rng, num, words):
+  prototypes = rng.dirichlet(np.full(words, 0.1), size=max(2, num // 50))
+  pairs = rng.randint(len(prototypes), size=(num, 2))
+  weights = rng.uniform(size=(num, 1))
+  mixed = weights * prototypes[pairs[:, 0]] + (1 - weights) * prototypes[pairs[:, 1]]
+  counts = np.array([rng.multinomial(500, p / p.sum()) for p in mixed],
+      dtype=np.float32)
+  return counts / counts.sum(axis=1, keepdims=True)
+
+def main(args):
+  rng = np.random.RandomState(args.seed)
+  if args.webcams:
+    with np.load(args.webcams) as data:
+      histograms = data['histograms'].astype(np.float32)
+  else:
+    histograms = synthetic_histograms(rng, args.synthetic, args.words)
+  order = rng.permutation(len(histograms))
+  queries = histograms[order[:args.queries]]
+  base = histograms[order[args.queries:]]
+  names = [str(i) for i in range(len(base))]
+
+  started = time.time()
+  index = IVFIndex(args.lists)
+  index.train(base)
+  index.add(names, base)
+  print("%d webcams, %d lists: built in %f s" % (len(base), args.lists,
+      time.time() - started))
+
+  vectors = hellinger_embedding(base)
+  norms = (vectors * vectors).sum(axis=1)
+  embedded = hellinger_embedding(queries)
+  started = time.time()
+  exact = [set(top_k(query, vectors, norms, args.k)[0]) for query in embedded]
+  elapsed = time.time() - started
+  print("exact: %f ms/query" % (1000 * elapsed / len(queries)))
+
+  nprobe = 1
+  while True:
+    nprobe = min(nprobe, args.lists)
+    started = time.time()
+    results = [index.query(query, args.k, nprobe) for query in queries]
+    elapsed = time.time() - started
+    recall = np.mean([len(truth & set(int(name) for name, _ in result)) /
+        float(max(1, len(truth))) for truth, result in zip(exact, results)])
+    print("nprobe %d: recall@%d %f, %f ms/query" % (nprobe, args.k, recall,
+        1000 * elapsed / len(queries)))
+    if nprobe == args.lists:
+      break
+    nprobe *= 2
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
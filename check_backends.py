@@ -0,0 +1,44 @@
+import argparse
+import cv2
+import sys
+
+from classify.backends import BACKENDS, max_difference
+from classify.classifier import CamClassifier
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dataset", help="Text file containing list of patches")
+  parser.add_argument("--backend", default="opencv", choices=BACKENDS,
+      help="Backend to check")
+  parser.add_argument("--reference", default="cpu", choices=BACKENDS,
+      help="Backend whose outputs are taken as correct")
+  parser.add_argument("--threads", type=int, help="Number of CPU threads")
+  parser.add_argument("--tolerance", type=float, default=1e-4,
+      help="Largest allowed difference between output probabilities")
+  parser.add_argument("--limit", type=int, default=256,
+      help="Number of patches to compare")
+  args = parser.parse_args()
+  return args
+
+def main(args):
+  with open(args.dataset) as dataset:
+    paths = [line.split()[0] for line in dataset if line.strip()][:args.limit]
+  patches = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+  patches = [patch for patch in patches if patch is not None]
+
+  reference = CamClassifier(backend=args.reference, threads=args.threads)
+  classifier = CamClassifier(backend=args.backend, threads=args.threads)
+  reference.set_batch_size(32)
+  classifier.set_batch_size(32)
+
+  difference = max_difference(classifier, reference, patches)
+  agreement = (classifier.forward_batch(patches).argmax(1) ==
+      reference.forward_batch(patches).argmax(1)).mean() if patches else 1.0
+  print "%s vs %s on %d patches" % (args.backend, args.reference, len(patches))
+  print "\tmax probability difference: %g" % difference
+  print "\ttop-1 agreement: %f" % agreement
+  return 0 if difference <= args.tolerance else 1
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  sys.exit(main(args))
@@ -1,96 +1,198 @@
 import argparse
+import collections
 import cv2
+import numpy as np
+import os
+import random
+import time
 
+from multiprocessing.pool import ThreadPool
+
+from classify.backends import BACKENDS, PRECISIONS
 from classify.classifier import CamClassifier
+from classify.probstore import ProbabilityStore
+from classify.rules import decide
+from dataset.records import PatchReader
 
 K_LABELS = ['animal', 'human', 'noise', 'vehicle']
 K_LABEL_INDEX = {label:i for i, label in enumerate(K_LABELS)}
 
+def add_arguments(parser):
+  parser.add_argument("dataset",
+      help="Text file containing list of patches, or a record directory")
+  parser.add_argument("--backend", default="gpu", choices=BACKENDS,
+      help="Inference backend")
+  parser.add_argument("--threads", type=int, help="Number of CPU threads")
+  parser.add_argument("--precision", default="fp32", choices=PRECISIONS,
+      help="Inference precision (fp16 and int8 need --backend opencv)")
+  parser.add_argument("--calibration",
+      help="Text file containing list of patches to calibrate int8 with")
+  parser.add_argument("--calibration-size", type=int, default=500,
+      help="Number of calibration patches sampled from --calibration")
+  parser.add_argument("--batch-size", type=int, default=64,
+      help="Number of patches per forward pass")
+  parser.add_argument("--workers", type=int, default=8,
+      help="Number of threads decoding patches")
+  parser.add_argument("--read-ahead", type=int, default=4,
+      help="Number of batches decoded ahead of inference")
+  parser.add_argument("--store",
+      help="Directory of stored probabilities; only new patches are classified")
+
 def retrieve_arguments():
   parser = argparse.ArgumentParser()
-  parser.add_argument("dataset", help="Text file containing list of patches")
+  add_arguments(parser)
   args = parser.parse_args()
   return args
 
-def filter_rankings(rankings):
-  labels_of_interest = set(('human', 'noise', 'vehicle'))
-  prob_of_label = {}
-  for label, idx, prob in rankings:
-    if label in labels_of_interest:
-      prob_of_label[label] = prob
-  return prob_of_label
-
-def classify(classifier, patch):
-  rankings = classifier.rankings(patch)
-  prob_of_label = filter_rankings(rankings)
-  if prob_of_label['noise'] < 1.0 - 0.95:
-    if prob_of_label['human'] > 0.6*prob_of_label['vehicle']:
-      return 'human'
-    else:
-      return 'vehicle'
+def read_patches(dataset, num_patches):
+  with open(dataset) as f:
+    paths = [line.split()[0] for line in f if line.strip()]
+  paths = random.sample(paths, min(num_patches, len(paths)))
+  patches = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+  return [patch for patch in patches if patch is not None]
+
+def imread(path):
+  return cv2.imread(path, cv2.IMREAD_COLOR)
+
+# Returns (paths, labels, read): a name for every patch of `dataset`, their
+# label indices and a function decoding a patch from its name. A record
+# directory (see dataset/records.py) names its patches <directory>/<id>.
+def read_labeled_patches(dataset):
+  if os.path.isdir(dataset):
+    reader = PatchReader(dataset)
+    paths = [os.path.join(dataset, str(i)) for i in range(len(reader))]
+    read = lambda path: reader.decode(int(os.path.basename(path)))
+    return paths, reader.labels(), read
+
+  with open(dataset) as f:
+    labeled_patches = [line.split() for line in f if line.strip()]
+  paths = [x[0] for x in labeled_patches]
+  labels = np.array([int(x[1]) for x in labeled_patches], dtype=np.int64)
+  return paths, labels, imread
+
+# Yields (indices, patches) for consecutive batches of `paths`, skipping
+# patches that fail to decode. Patches are decoded with `read` by a pool of
+# `workers` threads (cv2 decoding releases the GIL), up to `read_ahead`
+# batches ahead of the consumer.
+def decoded_batches(paths, batch_size, workers, read_ahead, read=imread):
+  pool = ThreadPool(workers)
+  starts = collections.deque(range(0, len(paths), batch_size))
+  pending = collections.deque()
+  try:
+    while starts or pending:
+      while starts and len(pending) < read_ahead:
+        start = starts.popleft()
+        pending.append((start, pool.map_async(read, paths[start:start + batch_size])))
+      start, result = pending.popleft()
+      patches = result.get()
+      indices = [start + i for i, patch in enumerate(patches) if patch is not None]
+      yield indices, [patch for patch in patches if patch is not None]
+  finally:
+    pool.terminate()
+
+# Creates the classifier without loading its net; see load_classifier.
+def create_classifier(args):
+  classifier = CamClassifier(backend=args.backend, threads=args.threads)
+  classifier.set_batch_size(args.batch_size)
+  return classifier
+
+# Loads the classifier's net at args.precision, calibrating int8 with patches
+# sampled from args.calibration.
+def load_classifier(classifier, args):
+  classifier.load()
+  if args.precision != 'fp32':
+    calibration = []
+    if args.calibration:
+      calibration = read_patches(args.calibration, args.calibration_size)
+    classifier.set_precision(args.precision, calibration)
+
+# Returns (indices, probabilities, num_inferred, inference_time): the indices
+# of the patches in `paths` that could be decoded (with `read`) and their
+# (N x num_outputs) probabilities. With a `store`, patches already in it are
+# not classified again and new ones are added to it. The net is only loaded
+# (see load_classifier) when some patches need classifying.
+def classify_patches(classifier, paths, args, store=None, read=imread):
+  if store is None:
+    todo = list(range(len(paths)))
   else:
-    return 'noise'
+    todo = [i for i, path in enumerate(paths) if path not in store]
+  if todo:
+    load_classifier(classifier, args)
+
+  inference_time = 0.0
+  indices = []
+  chunks = []
+  for batch, patches in decoded_batches([paths[i] for i in todo],
+      args.batch_size, args.workers, args.read_ahead, read):
+    start = time.time()
+    probabilities = classifier.forward_batch(patches)
+    inference_time += time.time() - start
+    batch = [todo[i] for i in batch]
+    if store is not None:
+      store.put([paths[i] for i in batch], probabilities)
+    indices.extend(batch)
+    chunks.append(probabilities)
+  num_inferred = len(indices)
+
+  if store is not None:
+    store.flush()
+    indices = [i for i, path in enumerate(paths) if path in store]
+    return indices, store.get([paths[i] for i in indices]), num_inferred, inference_time
+  if not chunks:
+    chunks = [np.zeros((0, len(classifier.labels_)), np.float32)]
+  return indices, np.concatenate(chunks), num_inferred, inference_time
+
+# Opens the store of args.store for the classifier at args.precision. The
+# store is keyed on the model files, so opening it does not load the net.
+def open_store(classifier, args):
+  if not args.store:
+    return None
+  return ProbabilityStore(args.store,
+      classifier.expected_model_version(args.precision), len(classifier.labels_))
 
 def main(args):
-  classifier = CamClassifier()
-  classifier.set_batch_size(1)  # TODO: Batch if its running to slowly.
-
-  with open(args.dataset) as dataset:
-    labeled_patches = [line.split() for line in dataset]
-    labeled_patches = [(x[0], int(x[1])) for x in labeled_patches]
-
-  num_labels = {label: 0 for label in K_LABELS}
-  num_classified = {label: 0 for label in K_LABELS}
-  num_correct = {label: 0 for label in K_LABELS}
-  num_present = {label: 0 for label in K_LABELS}
-
-  confusion = {}
-  for label in K_LABELS:
-    confusion[label] = {}
-    for label2 in K_LABELS:
-      confusion[label][label2] = 0
-
-  counter = 0
-  for patch, label in labeled_patches:
-    print patch
-    counter += 1
-    # print counter
-    patch = cv2.imread(patch, cv2.IMREAD_COLOR)
-    label = K_LABELS[label]
-    if patch is None:
-      continue
-    classification = classify(classifier, patch)
-
-    confusion[classification][label] += 1
-
-    print label, classification
-    num_labels[label] += 1
-    num_classified[classification] += 1
-    if label == classification:
-      num_correct[classification] += 1
-    if classification != 'noise':
-      num_present[label] += 1
-
-
-  print num_correct
-  print num_classified
-  print num_labels
-  for label in K_LABELS:
-    num_classified[label] = max(1, num_classified[label])
-    num_labels[label] = max(1, num_labels[label])
-
-  precision = {l: num_correct[l] / float(num_classified[l]) for l in K_LABELS}
-  recall = {l: num_correct[l] / float(num_labels[l]) for l in K_LABELS}
-
-  for label in K_LABELS:
-    print ("%s\n\tprecision: %f\n\trecall: %f" % (label, precision[label], recall[label]))
-
-  num_present['animal'] = 0
-  total_present = sum(num_present.values())
-  for label in K_LABELS:
-    print "%s filter precentage: %f" % (label, num_present[label]/float(total_present))
-
-  print confusion
+  classifier = create_classifier(args)
+  paths, labels, read = read_labeled_patches(args.dataset)
+
+  started = time.time()
+  classified, probabilities, num_inferred, inference_time = classify_patches(
+      classifier, paths, args, open_store(classifier, args), read)
+  decisions = decide(probabilities, classifier.label_index(), 1.0 - 0.95, 0.6)
+  classifications = [K_LABEL_INDEX[d] for d in decisions]
+  elapsed = time.time() - started
+
+  # confusion[classification, label] counts the patches with each pair.
+  n = len(K_LABELS)
+  label = labels[np.array(classified, dtype=np.int64)]
+  classification = np.array(classifications, dtype=np.int64)
+  confusion = np.bincount(classification * n + label,
+      minlength=n * n).reshape(n, n)
+
+  num_correct = np.diag(confusion)
+  num_classified = confusion.sum(axis=1)
+  num_labels = confusion.sum(axis=0)
+  noise = K_LABEL_INDEX['noise']
+  num_present = np.delete(confusion, noise, axis=0).sum(axis=0)
+
+  print dict(zip(K_LABELS, num_correct))
+  print dict(zip(K_LABELS, num_classified))
+  print dict(zip(K_LABELS, num_labels))
+
+  precision = num_correct / np.maximum(1, num_classified).astype(float)
+  recall = num_correct / np.maximum(1, num_labels).astype(float)
+  for i, label in enumerate(K_LABELS):
+    print ("%s\n\tprecision: %f\n\trecall: %f" % (label, precision[i], recall[i]))
+
+  num_present[K_LABEL_INDEX['animal']] = 0
+  total_present = max(1, num_present.sum())
+  for i, label in enumerate(K_LABELS):
+    print "%s filter precentage: %f" % (label, num_present[i]/float(total_present))
+
+  print dict((classified_as, dict(zip(K_LABELS, row)))
+      for classified_as, row in zip(K_LABELS, confusion))
+  print "%s %s: %d patches (%d classified) in %f s (%f patches/s), %f s of inference" % (
+      args.backend, args.precision, len(classified), num_inferred, elapsed,
+      len(classified) / max(elapsed, 1e-9), inference_time)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+import argparse
+import logging
+
+from classify.backends import BACKENDS
+from classify.classifier import CamClassifier
+from classify.server import ClassificationServer
+
+
+def main():
+  """Serves CamClassifier to local processes over a Unix socket.
+
+  Usage Example:
+    classification_server.py /tmp/camnet.sock --backend=cpu --max-batch=64
+
+  Clients connect with classify.server.ClassificationClient, which can be
+  passed wherever a classifier is expected (e.g. Webcam.filtered_overlay).
+  """
+  parser = argparse.ArgumentParser(prog='classification_server')
+  parser.add_argument('socket', help='Path of the Unix socket to listen on.')
+  parser.add_argument('-b', '--backend', default='gpu', choices=BACKENDS,
+      help='The inference backend.')
+  parser.add_argument('-t', '--threads', type=int,
+      help='The number of CPU threads for CPU backends.')
+  parser.add_argument('--max-batch', type=int, default=64,
+      help='The maximum number of patches per batch.')
+  parser.add_argument('--max-delay-ms', type=float, default=5,
+      help='The longest a request waits for its batch to fill.')
+  parser.add_argument('--max-request-pixels', type=int, default=1 << 24,
+      help='The largest request accepted, in patches * height * width.')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  classifier = CamClassifier(backend=args.backend, threads=args.threads)
+  classifier.set_batch_size(args.max_batch)
+  server = ClassificationServer(classifier, args.socket,
+      max_batch_size=args.max_batch, max_delay=args.max_delay_ms / 1000.0,
+      max_request_pixels=args.max_request_pixels)
+  server.serve_forever()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,157 @@
+import numpy as np
+import os
+import re
+
+# A backend runs a Caffe deploy net (deploy.prototxt + .caffemodel) whose
+# output layer is named 'prob'. Callers write preprocessed images into
+# input_data() and call forward().
+class Backend(object):
+  # abstract (required)
+  # Returns the shape of the input blob as (N, C, H, W).
+  def input_shape(self):
+    pass
+
+  # abstract (required)
+  # Sets the number of images in the input blob.
+  def reshape(self, batch_size):
+    pass
+
+  # abstract (required)
+  # Returns the input blob as a writable float32 array of input_shape().
+  def input_data(self):
+    pass
+
+  # abstract (required)
+  # Runs the net on the input blob. Returns an (N x num_outputs) array of
+  # probabilities that is not overwritten by later calls.
+  def forward(self):
+    pass
+
+  # Switches the arithmetic used for inference to one of PRECISIONS. 'int8'
+  # needs `calibration`, a list of preprocessed (N, C, H, W) float32 batches
+  # representative of the inputs. Only 'fp32' is supported by default.
+  def set_precision(self, precision, calibration=()):
+    if precision != 'fp32':
+      raise ValueError('The %s backend only supports fp32 inference.' %
+          type(self).__name__)
+
+class CaffeBackend(Backend):
+  # Caffe must be imported after the BLAS thread count is set, so it is only
+  # imported here. `threads` has no effect if caffe was imported earlier.
+  def __init__(self, model_path, weights_path, gpu=True, device=0, threads=None):
+    if threads:
+      for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+    import caffe
+
+    # This must be set BEFORE creating the net.
+    if gpu:
+      caffe.set_device(device)
+      caffe.set_mode_gpu()
+    else:
+      caffe.set_mode_cpu()
+    self.net_ = caffe.Net(model_path, weights_path, caffe.TEST)
+
+  def input_shape(self):
+    return self.net_.blobs['data'].data.shape
+
+  def reshape(self, batch_size):
+    data = self.net_.blobs['data']
+    data.reshape(batch_size, *data.data.shape[1:])
+    self.net_.reshape()
+
+  def input_data(self):
+    return self.net_.blobs['data'].data
+
+  def forward(self):
+    out = self.net_.forward()
+    return out['prob'].reshape(self.input_shape()[0], -1).copy()
+
+class OpenCVBackend(Backend):
+  def __init__(self, model_path, weights_path, threads=None):
+    import cv2
+    if threads:
+      cv2.setNumThreads(threads)
+    self.model_path_ = model_path
+    self.weights_path_ = weights_path
+    self.net_ = self.read_net(cv2.dnn.DNN_TARGET_CPU)
+    self.data_ = np.zeros(read_input_shape(model_path), np.float32)
+
+  def read_net(self, target):
+    import cv2
+    net = cv2.dnn.readNetFromCaffe(self.model_path_, self.weights_path_)
+    net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+    net.setPreferableTarget(target)
+    return net
+
+  # 'fp16' needs OpenCV's CPU_FP16 target (OpenCV 4.9+). 'int8' uses
+  # cv2.dnn.Net.quantize (OpenCV 4.5.4+), which picks per-layer scales from
+  # the activations the net produces on the calibration batches; inputs and
+  # outputs stay float32.
+  def set_precision(self, precision, calibration=()):
+    import cv2
+    if precision == 'fp32':
+      self.net_ = self.read_net(cv2.dnn.DNN_TARGET_CPU)
+    elif precision == 'fp16':
+      if not hasattr(cv2.dnn, 'DNN_TARGET_CPU_FP16'):
+        raise ValueError('This OpenCV build has no fp16 CPU target.')
+      self.net_ = self.read_net(cv2.dnn.DNN_TARGET_CPU_FP16)
+    elif precision == 'int8':
+      if not calibration:
+        raise ValueError('int8 inference needs calibration batches.')
+      net = self.read_net(cv2.dnn.DNN_TARGET_CPU)
+      self.net_ = net.quantize(list(calibration), cv2.CV_32F, cv2.CV_32F)
+      self.net_.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+      self.net_.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+    else:
+      raise ValueError('Unknown precision %s. Expected one of %s.' %
+          (precision, ', '.join(PRECISIONS)))
+
+  def input_shape(self):
+    return self.data_.shape
+
+  def reshape(self, batch_size):
+    self.data_ = np.zeros((batch_size,) + self.data_.shape[1:], np.float32)
+
+  def input_data(self):
+    return self.data_
+
+  def forward(self):
+    self.net_.setInput(self.data_)
+    return self.net_.forward('prob').reshape(len(self.data_), -1)
+
+# Returns the (N, C, H, W) input shape declared by a deploy.prototxt, either
+# with `input_dim` fields or with an `input_shape`/Input layer `shape`.
+def read_input_shape(model_path):
+  with open(model_path) as f:
+    prototxt = f.read()
+  dims = re.findall(r'input_dim\s*:\s*(\d+)', prototxt)
+  if not dims:
+    shape = re.search(r'shape\s*\{([^}]*)\}', prototxt)
+    dims = re.findall(r'dim\s*:\s*(\d+)', shape.group(1)) if shape else []
+  if len(dims) != 4:
+    raise ValueError('Could not find the input shape in %s' % model_path)
+  return tuple(int(d) for d in dims)
+
+PRECISIONS = ('fp32', 'fp16', 'int8')
+
+# 'gpu' and 'cpu' run the net with Caffe, 'opencv' with OpenCV's dnn module on
+# the CPU. `threads` sets the number of CPU threads.
+BACKENDS = ('gpu', 'cpu', 'opencv')
+
+def create_backend(name, model_path, weights_path, threads=None):
+  if name == 'gpu':
+    return CaffeBackend(model_path, weights_path, gpu=True)
+  elif name == 'cpu':
+    return CaffeBackend(model_path, weights_path, gpu=False, threads=threads)
+  elif name == 'opencv':
+    return OpenCVBackend(model_path, weights_path, threads=threads)
+  raise ValueError('Unknown backend %s. Expected one of %s.' % (name, ', '.join(BACKENDS)))
+
+# Returns the largest absolute difference between the probabilities two
+# classifiers output for the same images, e.g. to check a CPU backend against
+# the GPU one.
+def max_difference(classifier, reference, images):
+  if len(images) == 0:
+    return 0.0
+  return float(np.abs(classifier.forward_batch(images) - reference.forward_batch(images)).max())
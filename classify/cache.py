@@ -0,0 +1,128 @@
+import collections
+import cv2
+import hashlib
+import numpy as np
+
+# Rough number of bytes an entry costs besides its probability row (key,
+# OrderedDict node, array header). Used to enforce max_bytes.
+ENTRY_OVERHEAD = 200
+
+# Perceptual hash of an image (dHash): compares neighbouring pixels of a 9 x 8
+# grayscale thumbnail and packs the 64 results into an integer. Near-identical
+# images have hashes that differ in few bits.
+def perceptual_hash(image):
+  gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+  small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+  bits = (small[:, 1:] > small[:, :-1]).ravel()
+  return int(np.packbits(bits).view('>u8')[0])
+
+# Number of differing bits between `h` and each hash in the uint64 array
+# `hashes`.
+def hamming_distances(h, hashes):
+  different = np.bitwise_xor(np.asarray(hashes, np.uint64), np.uint64(h))
+  return np.unpackbits(different.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+# LRU cache of output probabilities, keyed by patch content.
+#
+# With tolerance=None, patches are keyed by a SHA-1 of their pixels, so only
+# identical patches hit. Preprocessing is deterministic, so this is the same
+# as keying by the preprocessed input, without paying for preprocessing.
+# With an integer tolerance, patches are keyed by perceptual_hash and a patch
+# hits if a cached hash is within `tolerance` bits of its own.
+#
+# The cache is bounded by max_entries and, optionally, max_bytes (see
+# ENTRY_OVERHEAD), evicting the least recently used entries first. It is
+# cleared whenever the model version passed to forward changes.
+class InferenceCache(object):
+  def __init__(self, max_entries=10000, max_bytes=None, tolerance=None):
+    self.max_entries_ = max_entries
+    self.max_bytes_ = max_bytes
+    self.tolerance_ = tolerance
+    self.entries_ = collections.OrderedDict()
+    self.bytes_ = 0
+    self.version_ = None
+    self.hits_ = 0
+    self.misses_ = 0
+    self.evictions_ = 0
+    self.invalidations_ = 0
+
+  def key(self, image):
+    if self.tolerance_ is None:
+      digest = hashlib.sha1(np.ascontiguousarray(image))
+      digest.update(str(image.shape).encode())
+      return digest.digest()
+    return perceptual_hash(image)
+
+  # Returns the cached key matching `key`, or None.
+  def find(self, key):
+    if key in self.entries_:
+      return key
+    if self.tolerance_ and self.entries_:
+      keys = list(self.entries_.keys())
+      distances = hamming_distances(key, keys)
+      closest = distances.argmin()
+      if distances[closest] <= self.tolerance_:
+        return keys[closest]
+    return None
+
+  # Returns the (N x num_outputs) probabilities of `images`. Only the images
+  # that miss are passed, as a list, to `compute`, which must return their
+  # probability matrix. `version` identifies the model (see
+  # Classifier.model_version).
+  def forward(self, images, compute, version):
+    if version != self.version_:
+      if self.entries_:
+        self.invalidations_ += 1
+      self.clear()
+      self.version_ = version
+
+    keys = [self.key(image) for image in images]
+    rows = [None] * len(images)
+    missing = []
+    for i, key in enumerate(keys):
+      found = self.find(key)
+      if found is None:
+        missing.append(i)
+      else:
+        # Move the entry to the most recently used end.
+        rows[i] = self.entries_.pop(found)
+        self.entries_[found] = rows[i]
+    self.hits_ += len(images) - len(missing)
+    self.misses_ += len(missing)
+
+    if missing:
+      computed = compute([images[i] for i in missing])
+      for i, row in zip(missing, computed):
+        rows[i] = row.copy()
+        self.insert(keys[i], rows[i])
+
+    if not rows:
+      return compute([])
+    return np.array(rows)
+
+  def insert(self, key, row):
+    if key in self.entries_:
+      self.bytes_ -= self.entries_.pop(key).nbytes + ENTRY_OVERHEAD
+    self.entries_[key] = row
+    self.bytes_ += row.nbytes + ENTRY_OVERHEAD
+    while self.entries_ and (len(self.entries_) > self.max_entries_ or
+        (self.max_bytes_ is not None and self.bytes_ > self.max_bytes_)):
+      _, evicted = self.entries_.popitem(last=False)
+      self.bytes_ -= evicted.nbytes + ENTRY_OVERHEAD
+      self.evictions_ += 1
+
+  def clear(self):
+    self.entries_.clear()
+    self.bytes_ = 0
+
+  def stats(self):
+    lookups = self.hits_ + self.misses_
+    return {
+        'hits': self.hits_,
+        'misses': self.misses_,
+        'hit_rate': self.hits_ / float(lookups) if lookups else 0.0,
+        'evictions': self.evictions_,
+        'invalidations': self.invalidations_,
+        'entries': len(self.entries_),
+        'bytes': self.bytes_,
+    }
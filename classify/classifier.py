@@ -1,19 +1,89 @@
-import caffe
+import hashlib
 import numpy as np
 import os
+import tempfile
+
+from .backends import create_backend
+from .cache import InferenceCache
+from .preprocess import Preprocessor
 
 def my_directory():
   return os.path.dirname(os.path.realpath(__file__))
 
+# Parsed label tables, per path, shared by every classifier in the process.
+label_tables = {}
+
+# Directory of parsed label tables, outside the source tree so checkouts stay
+# clean and may be read-only.
+def label_cache_directory():
+  return os.path.join(tempfile.gettempdir(), 'label_tables')
+
+# Loads a label file with np.loadtxt(path, str, delimiter='\t'). The parsed
+# table is cached in label_cache_directory(), under a digest of the file's
+# path, and later processes load it instead of parsing the text again. The
+# cache is rebuilt when the text file is newer, and skipped if it cannot be
+# written.
+def load_label_table(path):
+  if path not in label_tables:
+    digest = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()[:16]
+    cache_path = os.path.join(label_cache_directory(), digest + '.npy')
+    if (os.path.exists(cache_path) and
+        os.path.getmtime(cache_path) >= os.path.getmtime(path)):
+      table = np.load(cache_path)
+    else:
+      table = np.loadtxt(path, str, delimiter='\t')
+      try:
+        if not os.path.isdir(label_cache_directory()):
+          os.makedirs(label_cache_directory())
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+          np.save(f, table)
+        os.rename(tmp_path, cache_path)
+      except (IOError, OSError):
+        pass
+    label_tables[path] = table
+  return label_tables[path]
+
 class Classifier(object):
-  def __init__(self):
-    # We will always use the GPU. This must be set BEFORE creating the net.
-    caffe.set_device(0)
-    caffe.set_mode_gpu()
+  # `backend` is one of backends.BACKENDS: 'gpu' (Caffe on GPU 0), 'cpu' (Caffe
+  # on the CPU) or 'opencv' (OpenCV's dnn module on the CPU). `threads` sets
+  # the number of CPU threads the backend uses.
+  #
+  # Nothing is loaded here: the net is loaded on first use, or by load(), and
+  # the labels on first access to labels_.
+  def __init__(self, backend='gpu', threads=None):
+    self.backend_name_ = backend
+    self.threads_ = threads
+    self.backend_ = None
+    self.labels_table_ = None
+    self.batch_size_ = None
+    self.cache_ = None
 
-    self.net_ = caffe.Net(self.model_path(), self.weights_path(), caffe.TEST)
+  # Loads the net and its preprocessing. Call it before forking workers that
+  # should share the weights (see workers.fork_workers).
+  def load(self):
+    if self.backend_ is not None:
+      return
+    self.backend_ = create_backend(self.backend_name_, self.model_path(),
+        self.weights_path(), self.threads_)
+    if self.batch_size_ is None:
+      self.batch_size_ = self.backend_.input_shape()[0]
+    else:
+      self.backend_.reshape(self.batch_size_)
+    self.weights_version_ = self.weights_version()
+    self.precision_ = 'fp32'
     self.transformer_ = self.create_transformer()
-    self.labels_ = self.load_labels()
+
+  @property
+  def net_(self):
+    self.load()
+    return self.backend_
+
+  @property
+  def labels_(self):
+    if self.labels_table_ is None:
+      self.labels_table_ = self.load_labels()
+    return self.labels_table_
 
 
 
@@ -22,25 +92,126 @@ class Classifier(object):
   #        of size (H x W x 3) in RGB or
   #        of size (H x W x 1) in grayscale.
   def classify(self, image):
-    normalized = image.astype(np.float32) / image.max()
-    self.net_.blobs['data'].data[...] = self.transformer_.preprocess('data', normalized)
-    out = self.net_.forward()
-    return out['prob'][0].argmax()
+    return self.classify_batch([image])[0]
 
   def rankings(self, image):
-    normalized = image.astype(np.float32) / image.max()
-    self.net_.blobs['data'].data[...] = self.transformer_.preprocess('data', normalized)
-    out = self.net_.forward()
-    probabilities = out['prob'][0]
-    ordered  = out['prob'][0].argsort()
-    infos = [(self.label(o), o, out['prob'][0][o]) for o in reversed(ordered)]
+    return self.rankings_batch([image])[0]
+
+  # Batched versions of classify and rankings. `images` is a list of (H x W x 3)
+  # images or an (N x H x W x 3) array. The images are run through the net in
+  # chunks of the batch size (see set_batch_size) and one result is returned
+  # per image.
+  def classify_batch(self, images):
+    return list(self.forward_batch(images).argmax(axis=1))
+
+  def rankings_batch(self, images):
+    infos = []
+    for probabilities in self.forward_batch(images):
+      ordered = probabilities.argsort()
+      infos.append([(self.label(o), o, probabilities[o]) for o in reversed(ordered)])
+    return infos
+
+  # Returns the k most probable labels of each image as an (N x k) structured
+  # array with the fields of the rankings tuples: 'label', 'idx' and 'prob',
+  # most probable first. Only the top k are sorted, so this is much cheaper
+  # than rankings_batch for nets with many outputs.
+  def top_k_batch(self, images, k=5):
+    return self.top_k(self.forward_batch(images), k)
+
+  # Same as top_k_batch, for an (N x num_outputs) probability matrix.
+  def top_k(self, probabilities, k=5):
+    k = min(k, probabilities.shape[1])
+    rows = np.arange(len(probabilities))[:, None]
+    top = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    top = top[rows, np.argsort(-probabilities[rows, top], axis=1)]
+    labels = np.asarray(self.labels_)
+    infos = np.empty(top.shape, dtype=[('label', labels.dtype),
+        ('idx', np.int32), ('prob', np.float32)])
+    infos['label'] = labels[top]
+    infos['idx'] = top
+    infos['prob'] = probabilities[rows, top]
     return infos
 
+  # Maps each label to its column in the matrices returned by forward_batch.
+  def label_index(self):
+    index = {}
+    for i, label in enumerate(self.labels_):
+      index.setdefault(label, i)
+    return index
+
+  # Returns an (N x num_outputs) array with the net's output probabilities for
+  # each image. The input blob is reshaped whenever a chunk is smaller than the
+  # batch size, i.e. for the last chunk, and back on the next call. Goes
+  # through the inference cache if one is enabled.
+  def forward_batch(self, images):
+    if self.cache_ is not None:
+      return self.cache_.forward(images, self.forward_uncached, self.model_version())
+    return self.forward_uncached(images)
+
+  def forward_uncached(self, images):
+    self.load()
+    chunks = []
+    for start in range(0, len(images), self.batch_size_):
+      chunk = images[start:start + self.batch_size_]
+      if self.net_.input_shape()[0] != len(chunk):
+        self.net_.reshape(len(chunk))
+      self.transformer_.preprocess_batch(chunk, self.net_.input_data())
+      chunks.append(self.net_.forward())
+    if not chunks:
+      return np.zeros((0, len(self.labels_)), np.float32)
+    return np.concatenate(chunks)
+
+  # Runs inference at one of backends.PRECISIONS ('fp32', 'fp16' or 'int8').
+  # Reduced precision is only available on the 'opencv' backend. For 'int8',
+  # `calibration_images` are (H x W x 3) patches like the ones that will be
+  # classified, e.g. a few hundred labeled patches; they are preprocessed and
+  # passed to the backend to pick quantization scales. Changes model_version,
+  # so cached outputs of the previous precision are dropped.
+  def set_precision(self, precision, calibration_images=()):
+    self.load()
+    calibration = []
+    for start in range(0, len(calibration_images), self.batch_size_):
+      chunk = calibration_images[start:start + self.batch_size_]
+      blob = np.empty((len(chunk),) + tuple(self.backend_.input_shape()[1:]), np.float32)
+      calibration.append(self.transformer_.preprocess_batch(chunk, blob))
+    self.backend_.set_precision(precision, calibration)
+    self.precision_ = precision
+
+  # Puts a cache.InferenceCache in front of the net, so repeated patches are
+  # not run through it again. See InferenceCache for the arguments; its
+  # statistics are available from cache_stats().
+  def enable_cache(self, max_entries=10000, max_bytes=None, tolerance=None):
+    self.cache_ = InferenceCache(max_entries, max_bytes, tolerance)
+
+  def cache_stats(self):
+    return self.cache_.stats() if self.cache_ is not None else None
+
+  # Identifies the weights the net was loaded with and the precision it runs
+  # at. The inference cache is cleared whenever it changes.
+  def model_version(self):
+    self.load()
+    return '%s:%s' % (self.weights_version_, self.precision_)
+
+  # The model_version the classifier has once loaded and set to `precision`,
+  # computed from the model files without loading the net.
+  def expected_model_version(self, precision='fp32'):
+    return '%s:%s' % (self.weights_version(), precision)
+
+  # Identifies the net definition and weights currently on disk by their
+  # paths, sizes and modification times.
+  def weights_version(self):
+    versions = []
+    for path in (self.model_path(), self.weights_path()):
+      stat = os.stat(path)
+      versions.append('%s:%d:%d' % (path, stat.st_size, stat.st_mtime))
+    return ':'.join(versions)
+
   # Returns a human-readable label for the given classification.
   def label(self, classification):
     return self.labels_[classification]
 
   # abstract (required)
+  # Returns the preprocess.Preprocessor for the net's input.
   def create_transformer(self):
     pass
 
@@ -52,26 +223,25 @@ class Classifier(object):
   def weights_path(self):
     pass
 
-  # abstract (optional)
+  # Sets the number of images run through the net per forward pass.
   def set_batch_size(self, batch_size):
-    pass
+    self.batch_size_ = batch_size
+    if self.backend_ is not None:
+      self.backend_.reshape(batch_size)
 
   # abstract (optional)
   def load_labels(self):
     pass
 
 class ReferenceClassifier(Classifier):
-  def __init__(self):
-    super(ReferenceClassifier, self).__init__()
+  def __init__(self, backend='gpu', threads=None):
+    super(ReferenceClassifier, self).__init__(backend, threads)
 
   def create_transformer(self):
-    t = caffe.io.Transformer({'data': self.net_.blobs['data'].data.shape})
-    t.set_transpose('data', (2,0,1))
     mean_path = my_directory() + '/imagenet/ilsvrc_2012_mean.npy'
-    t.set_mean('data', np.load(mean_path).mean(1).mean(1))
-    t.set_raw_scale('data', 255)
-    t.set_channel_swap('data', (2,1,0))
-    return t
+    return Preprocessor(self.net_.input_shape(),
+        mean=np.load(mean_path).mean(1).mean(1), raw_scale=255,
+        channel_swap=(2,1,0))
 
   def model_path(self):
     return my_directory() + '/models/bvlc_reference_caffenet/deploy.prototxt'
@@ -79,25 +249,18 @@ class ReferenceClassifier(Classifier):
   def weights_path(self):
     return my_directory() + '/models/bvlc_reference_caffenet/bvlc_reference_caffenet.caffemodel'
 
-  def set_batch_size(self, batch_size):
-    self.net_.blobs['data'].reshape(batch_size, 3, 227, 227)
-
   def load_labels(self):
-    return np.loadtxt(my_directory() + '/ilsvrc12/synset_words.txt', str,
-        delimiter='\t')
+    return load_label_table(my_directory() + '/ilsvrc12/synset_words.txt')
 
 class CamClassifier(Classifier):
-  def __init__(self):
-    super(CamClassifier, self).__init__()
+  def __init__(self, backend='gpu', threads=None):
+    super(CamClassifier, self).__init__(backend, threads)
 
   def create_transformer(self):
-    t = caffe.io.Transformer({'data': self.net_.blobs['data'].data.shape})
-    t.set_transpose('data', (2,0,1))
     mean_path = my_directory() + '/imagenet/ilsvrc_2012_mean.npy'
-    t.set_mean('data', np.load(mean_path).mean(1).mean(1))
-    t.set_raw_scale('data', 255)
-    # t.set_channel_swap('data', (2,1,0))
-    return t
+    return Preprocessor(self.net_.input_shape(),
+        mean=np.load(mean_path).mean(1).mean(1), raw_scale=255)
+        # channel_swap=(2,1,0)
 
   def model_path(self):
     return my_directory() + '/models/camnet2/deploy.prototxt'
@@ -105,8 +268,5 @@ class CamClassifier(Classifier):
   def weights_path(self):
     return my_directory() + '/models/camnet2/net2.caffemodel'
 
-  def set_batch_size(self, batch_size):
-    self.net_.blobs['data'].reshape(batch_size, 3, 227, 227)
-
   def load_labels(self):
     return ['animal', 'human', 'noise', 'vehicle'] + ['NA'] * 16
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+
+# Batched replacement for the caffe.io.Transformer configurations used by the
+# classifiers. For every image it does what
+#   transformer.preprocess('data', image.astype(np.float32) / image.max())
+# does with set_transpose('data', (2,0,1)), set_mean, set_raw_scale and
+# set_channel_swap, but over the whole batch with a handful of NumPy operations
+# that write straight into the net's input blob.
+class Preprocessor(object):
+  # `input_shape` is the (N, C, H, W) shape of the input blob; only H and W are
+  # used. `mean` holds one value per input channel, in the net's channel order.
+  def __init__(self, input_shape, mean=None, raw_scale=1.0, channel_swap=None):
+    self.size_ = tuple(input_shape[2:])
+    self.mean_ = None if mean is None else np.asarray(mean, np.float32)
+    self.raw_scale_ = raw_scale
+    self.channel_swap_ = channel_swap
+
+  # `images` is a list of (H x W x 3) images or an (N x H x W x 3) array. `out`
+  # is the (N x 3 x H' x W') float32 array to fill, usually the input blob.
+  def preprocess_batch(self, images, out):
+    n = len(images)
+    if isinstance(images, np.ndarray) and images.ndim == 4:
+      maxima = images.reshape(n, -1).max(axis=1)
+    else:
+      maxima = np.array([image.max() for image in images])
+    scale = (self.raw_scale_ / maxima.astype(np.float32)).reshape(n, 1, 1)
+
+    # Like caffe.io.resize_image, images that do not match the input size are
+    # resized bilinearly, after the maximum has been taken.
+    height, width = self.size_
+    if not (isinstance(images, np.ndarray) and images.shape[1:3] == self.size_):
+      resized = np.empty((n, height, width, 3), np.float32)
+      for i, image in enumerate(images):
+        if image.shape[0:2] == self.size_:
+          resized[i] = image
+        else:
+          cv2.resize(image.astype(np.float32), (width, height), dst=resized[i])
+      images = resized
+
+    channel_swap = self.channel_swap_ or range(out.shape[1])
+    for channel, source in enumerate(channel_swap):
+      np.multiply(images[..., source], scale, out=out[:, channel])
+      if self.mean_ is not None:
+        out[:, channel] -= self.mean_[channel]
+    return out
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+# Persistent, memory-mapped store of the output probabilities of one model
+# version, keyed by patch path. Lets threshold experiments reuse a single
+# inference pass over a dataset.
+#
+# Files live under <directory>/<digest of the model version>/:
+#   probabilities.f32 : float32 (capacity x num_outputs) matrix, memory mapped
+#                       and grown by doubling
+#   index.json        : the model version, num_outputs and {path: row}
+# Rows are written before the index that points at them, so an interrupted
+# run at worst loses rows that were never indexed. put() flushes whenever
+# `flush_interval` seconds have passed since the last flush, so that is at
+# most the rows of the last interval.
+class ProbabilityStore(object):
+  def __init__(self, directory, model_version, num_outputs, flush_interval=60):
+    digest = hashlib.sha1(model_version.encode()).hexdigest()[:16]
+    self.directory_ = os.path.join(directory, digest)
+    self.data_path_ = os.path.join(self.directory_, 'probabilities.f32')
+    self.index_path_ = os.path.join(self.directory_, 'index.json')
+    self.model_version_ = model_version
+    self.num_outputs_ = num_outputs
+    self.rows_ = {}
+    self.data_ = None
+    self.capacity_ = 0
+    self.flush_interval_ = flush_interval
+    self.last_flush_ = time.time()
+
+    if not os.path.isdir(self.directory_):
+      os.makedirs(self.directory_)
+    if os.path.exists(self.index_path_):
+      with open(self.index_path_) as f:
+        index = json.load(f)
+      if index['num_outputs'] != num_outputs:
+        raise ValueError('%s holds %d outputs per patch, not %d.' %
+            (self.directory_, index['num_outputs'], num_outputs))
+      self.rows_ = index['rows']
+    if os.path.exists(self.data_path_):
+      self.open(os.path.getsize(self.data_path_) // (4 * num_outputs))
+
+  def open(self, capacity):
+    if self.data_ is not None:
+      self.data_.flush()
+      self.data_ = None
+    with open(self.data_path_, 'ab') as f:
+      f.truncate(capacity * self.num_outputs_ * 4)
+    self.capacity_ = capacity
+    if capacity:
+      self.data_ = np.memmap(self.data_path_, np.float32, 'r+',
+          shape=(capacity, self.num_outputs_))
+
+  def __len__(self):
+    return len(self.rows_)
+
+  def __contains__(self, path):
+    return path in self.rows_
+
+  # Stores one row of `probabilities` per path, replacing existing rows.
+  def put(self, paths, probabilities):
+    new = [path for path in paths if path not in self.rows_]
+    if len(self.rows_) + len(new) > self.capacity_:
+      self.open(max(1024, 2 * self.capacity_, len(self.rows_) + len(new)))
+    for path in new:
+      if path not in self.rows_:
+        self.rows_[path] = len(self.rows_)
+    rows = np.array([self.rows_[path] for path in paths], dtype=np.int64)
+    self.data_[rows] = probabilities
+    if time.time() - self.last_flush_ >= self.flush_interval_:
+      self.flush()
+
+  # Returns the (N x num_outputs) probabilities of `paths`, which must all be
+  # in the store.
+  def get(self, paths):
+    if not paths:
+      return np.zeros((0, self.num_outputs_), np.float32)
+    rows = np.array([self.rows_[path] for path in paths], dtype=np.int64)
+    return np.asarray(self.data_[rows])
+
+  # Makes everything put so far durable.
+  def flush(self):
+    if self.data_ is not None:
+      self.data_.flush()
+    tmp_path = self.index_path_ + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'version': self.model_version_,
+          'num_outputs': self.num_outputs_, 'rows': self.rows_}, f)
+    os.rename(tmp_path, self.index_path_)
+    self.last_flush_ = time.time()
@@ -0,0 +1,50 @@
+import numpy as np
+
+# Decision rule used to filter detected patches, applied to every row of an
+# (N x num_outputs) probability matrix at once. `label_index` maps the labels
+# 'noise', 'human' and 'vehicle' to their columns (see
+# Classifier.label_index). A patch is noise unless p(noise) < noise_threshold;
+# otherwise it is a human if p(human) > human_ratio * p(vehicle) and a vehicle
+# if not. Returns an array of N labels.
+def decide(probabilities, label_index, noise_threshold, human_ratio=1.0):
+  noise = probabilities[:, label_index['noise']]
+  human = probabilities[:, label_index['human']]
+  vehicle = probabilities[:, label_index['vehicle']]
+  return np.where(noise < noise_threshold,
+      np.where(human > human_ratio * vehicle, 'human', 'vehicle'), 'noise')
+
+# Evaluates decide() for every pair of noise_thresholds[t] and
+# human_ratios[r] at once. `truth` holds the true label of each row of
+# `probabilities`. Returns a dict mapping 'human', 'vehicle' and 'noise' to
+# (correct, classified, labeled) count arrays of shape (T x R), computed with
+# two matrix products instead of T * R passes over the patches.
+def sweep(probabilities, truth, label_index, noise_thresholds, human_ratios):
+  noise = probabilities[:, label_index['noise']]
+  human = probabilities[:, label_index['human']]
+  vehicle = probabilities[:, label_index['vehicle']]
+  shape = (len(noise_thresholds), len(human_ratios))
+
+  kept = (noise[None, :] < np.asarray(noise_thresholds)[:, None]).astype(np.float32)
+  human_wins = (human[None, :] > np.asarray(human_ratios)[:, None] * vehicle[None, :]).astype(np.float32)
+  is_human = (truth == 'human').astype(np.float32)
+  is_vehicle = (truth == 'vehicle').astype(np.float32)
+  is_noise = (truth == 'noise').astype(np.float32)
+
+  num_kept = kept.sum(axis=1)[:, None]
+  classified_human = kept.dot(human_wins.T)
+  counts = {
+      'human': (
+          (kept * is_human).dot(human_wins.T),
+          classified_human,
+          np.full(shape, is_human.sum())),
+      'vehicle': (
+          (kept * is_vehicle).dot(1 - human_wins.T),
+          num_kept - classified_human,
+          np.full(shape, is_vehicle.sum())),
+      'noise': (
+          np.broadcast_to(((1 - kept) * is_noise).sum(axis=1)[:, None], shape),
+          np.broadcast_to(len(noise) - num_kept, shape),
+          np.full(shape, is_noise.sum())),
+  }
+  return dict((label, tuple(np.rint(c).astype(np.int64) for c in count))
+      for label, count in counts.items())
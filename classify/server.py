@@ -0,0 +1,231 @@
+import collections
+import json
+import logging
+import numpy as np
+import os
+import socket
+import struct
+import threading
+import time
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+# Wire format, over a Unix stream socket:
+#   server hello: HELLO, then that many bytes of JSON {'labels': [...]}
+#   request:      REQUEST (request id, N, H, W, C), then N*H*W*C uint8 pixels
+#   response:     RESPONSE (request id, N, K), then N*K little-endian float32
+# The server closes the connection on a malformed request and on requests
+# whose batch failed to classify.
+HELLO = struct.Struct('!I')
+REQUEST = struct.Struct('!QIIII')
+RESPONSE = struct.Struct('!QII')
+
+def recv_exactly(conn, size):
+  chunks = []
+  while size > 0:
+    chunk = conn.recv(min(size, 1 << 20))
+    if not chunk:
+      raise EOFError('Connection closed')
+    chunks.append(chunk)
+    size -= len(chunk)
+  return b''.join(chunks)
+
+class Request(object):
+  def __init__(self, connection, request_id, patches):
+    self.connection = connection
+    self.request_id = request_id
+    self.patches = patches
+    self.arrival = time.time()
+
+class Connection(object):
+  def __init__(self, sock):
+    self.sock = sock
+    self.lock = threading.Lock()
+
+  def reply(self, request_id, probabilities):
+    probabilities = np.ascontiguousarray(probabilities, dtype='<f4')
+    with self.lock:
+      self.sock.sendall(RESPONSE.pack(request_id, probabilities.shape[0],
+          probabilities.shape[1]) + probabilities.tobytes())
+
+  # Wakes up the reader thread and any client blocked on a response.
+  def close(self):
+    try:
+      self.sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass
+
+# Serves one classifier to many local processes. Patches from concurrent
+# requests are grouped into dynamic batches: a batch is run as soon as it
+# holds max_batch_size patches or its oldest request has waited max_delay
+# seconds. Per-request latency (queueing plus inference) and batch fill are
+# logged every `report_every` batches and available from stats(). Requests of
+# more than `max_request_pixels` (N*H*W) pixels are refused.
+class ClassificationServer(object):
+  def __init__(self, classifier, socket_path, max_batch_size=64,
+      max_delay=0.005, report_every=100, max_request_pixels=1 << 24):
+    self.classifier_ = classifier
+    self.socket_path_ = socket_path
+    self.max_batch_size_ = max_batch_size
+    self.max_delay_ = max_delay
+    self.max_request_pixels_ = max_request_pixels
+    self.report_every_ = report_every
+    self.requests_ = queue.Queue()
+    self.logger_ = logging.getLogger('classify.server.ClassificationServer')
+    self.latencies_ = collections.deque(maxlen=10000)
+    self.fills_ = collections.deque(maxlen=10000)
+    self.num_batches_ = 0
+    self.num_patches_ = 0
+    self.hello_ = json.dumps({'labels': list(map(str, classifier.labels_))}).encode()
+
+  def serve_forever(self):
+    if os.path.exists(self.socket_path_):
+      os.remove(self.socket_path_)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(self.socket_path_)
+    listener.listen(64)
+
+    batcher = threading.Thread(target=self.batch_forever)
+    batcher.daemon = True
+    batcher.start()
+
+    self.logger_.info('Serving on %s.' % self.socket_path_)
+    while True:
+      sock, _ = listener.accept()
+      reader = threading.Thread(target=self.read_requests, args=(sock,))
+      reader.daemon = True
+      reader.start()
+
+  def read_requests(self, sock):
+    connection = Connection(sock)
+    try:
+      with connection.lock:
+        sock.sendall(HELLO.pack(len(self.hello_)) + self.hello_)
+      while True:
+        request_id, n, h, w, c = REQUEST.unpack(recv_exactly(sock, REQUEST.size))
+        if c != 3 or n * h * w == 0 or n * h * w > self.max_request_pixels_:
+          self.logger_.warning('Dropping connection after a request of shape '
+              '%dx%dx%dx%d.' % (n, h, w, c))
+          break
+        pixels = recv_exactly(sock, n * h * w * c)
+        patches = np.frombuffer(pixels, np.uint8).reshape(n, h, w, c)
+        self.requests_.put(Request(connection, request_id, patches))
+    except (EOFError, socket.error):
+      pass
+    connection.close()
+    sock.close()
+
+  def next_batch(self):
+    batch = [self.requests_.get()]
+    size = len(batch[0].patches)
+    deadline = batch[0].arrival + self.max_delay_
+    while size < self.max_batch_size_:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        break
+      try:
+        request = self.requests_.get(timeout=timeout)
+      except queue.Empty:
+        break
+      batch.append(request)
+      size += len(request.patches)
+    return batch
+
+  def batch_forever(self):
+    while True:
+      batch = self.next_batch()
+      shapes = set(request.patches.shape[1:] for request in batch)
+      if len(shapes) == 1:
+        images = np.concatenate([request.patches for request in batch])
+      else:
+        images = [patch for request in batch for patch in request.patches]
+      try:
+        probabilities = self.classifier_.forward_batch(images)
+      except Exception:
+        self.logger_.exception('Failed to classify a batch of %d requests.'
+            % len(batch))
+        for request in batch:
+          request.connection.close()
+        continue
+
+      start = 0
+      now = time.time()
+      for request in batch:
+        end = start + len(request.patches)
+        try:
+          request.connection.reply(request.request_id, probabilities[start:end])
+        except socket.error:
+          pass
+        self.latencies_.append(now - request.arrival)
+        start = end
+
+      self.fills_.append(len(images) / float(self.max_batch_size_))
+      self.num_batches_ += 1
+      self.num_patches_ += len(images)
+      if self.num_batches_ % self.report_every_ == 0:
+        self.logger_.info(self.format_stats())
+
+  # Latency percentiles are in milliseconds, over the most recent requests.
+  def stats(self):
+    latencies = np.array(self.latencies_) * 1000
+    fills = np.array(self.fills_)
+    return {
+        'batches': self.num_batches_,
+        'patches': self.num_patches_,
+        'latency_ms_p50': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        'latency_ms_p95': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        'mean_batch_fill': float(fills.mean()) if len(fills) else 0.0,
+    }
+
+  def format_stats(self):
+    stats = self.stats()
+    return ('%d batches, %d patches, latency p50 %.1f ms p95 %.1f ms, '
+        'mean batch fill %.2f' % (stats['batches'], stats['patches'],
+            stats['latency_ms_p50'], stats['latency_ms_p95'],
+            stats['mean_batch_fill']))
+
+# Talks to a ClassificationServer. Provides the parts of the Classifier
+# interface that callers such as Webcam.filtered_overlay use, so it can be
+# passed in place of a classifier.
+class ClassificationClient(object):
+  def __init__(self, socket_path):
+    self.sock_ = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock_.connect(socket_path)
+    self.lock_ = threading.Lock()
+    self.next_id_ = 0
+    size, = HELLO.unpack(recv_exactly(self.sock_, HELLO.size))
+    self.labels_ = json.loads(recv_exactly(self.sock_, size).decode())['labels']
+
+  # `images` is an (N x H x W x 3) uint8 array or a list of same-sized
+  # (H x W x 3) uint8 images.
+  def forward_batch(self, images):
+    patches = np.ascontiguousarray(images, dtype=np.uint8)
+    if len(patches) == 0:
+      return np.zeros((0, len(self.labels_)), np.float32)
+    with self.lock_:
+      request_id = self.next_id_
+      self.next_id_ += 1
+      self.sock_.sendall(REQUEST.pack(request_id, *patches.shape) + patches.tobytes())
+      response_id, n, k = RESPONSE.unpack(recv_exactly(self.sock_, RESPONSE.size))
+      assert response_id == request_id, (
+          'Response %d for request %d' % (response_id, request_id))
+      probabilities = np.frombuffer(recv_exactly(self.sock_, n * k * 4), '<f4')
+    return probabilities.reshape(n, k).astype(np.float32)
+
+  def classify_batch(self, images):
+    return list(self.forward_batch(images).argmax(axis=1))
+
+  def label(self, classification):
+    return self.labels_[classification]
+
+  def label_index(self):
+    index = {}
+    for i, label in enumerate(self.labels_):
+      index.setdefault(label, i)
+    return index
+
+  def close(self):
+    self.sock_.close()
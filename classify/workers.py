@@ -0,0 +1,42 @@
+import gc
+import os
+import traceback
+
+# Runs target(classifier, worker_index, *args) in `num_workers` forked
+# processes and returns their pids (see wait_workers).
+#
+# The net is loaded once, here in the parent, before forking. Inference never
+# writes to the weights, so every worker keeps sharing the parent's weight
+# pages copy-on-write instead of loading its own copy. Not supported for the
+# 'gpu' backend, as CUDA contexts do not survive a fork.
+def fork_workers(classifier, num_workers, target, args=()):
+  if classifier.backend_name_ == 'gpu':
+    raise ValueError('The gpu backend cannot be shared with forked workers.')
+  classifier.load()
+  classifier.labels_
+
+  # Keep the garbage collector from touching (and so copying) the pages of
+  # objects that already exist, where supported (Python 3.7+).
+  if hasattr(gc, 'freeze'):
+    gc.freeze()
+
+  pids = []
+  for i in range(num_workers):
+    pid = os.fork()
+    if pid == 0:
+      status = 0
+      try:
+        target(classifier, i, *args)
+      except Exception:
+        traceback.print_exc()
+        status = 1
+      finally:
+        os._exit(status)
+    pids.append(pid)
+  return pids
+
+# Waits for the workers started by fork_workers. Returns True if all of them
+# exited successfully.
+def wait_workers(pids):
+  statuses = [os.waitpid(pid, 0)[1] for pid in pids]
+  return all(status == 0 for status in statuses)
@@ -0,0 +1,53 @@
+#! /bin/python3.5
+
+import argparse
+import logging
+import os
+import time
+
+import webcam.retention
+
+
+def main():
+  """Thins the frames archive and keeps it within a disk budget.
+
+  Usage Example:
+    compact_frames.py --tiers 48h:all,30d:1h,inf:1d --budget 200 --interval 10
+  """
+  parser = argparse.ArgumentParser(prog='compact_frames')
+  parser.add_argument('-f', '--frames', required=False,
+      default="%s/webcam/frames" % os.path.dirname(os.path.realpath(__file__)),
+      help='The directory of per-webcam frame directories.')
+  parser.add_argument('-t', '--tiers', required=False,
+      default='48h:all,30d:1h,inf:1d',
+      help='Comma separated <max age>:<spacing> retention tiers.')
+  parser.add_argument('-b', '--budget', type=float, required=False,
+      help='The size budget of the frames (in GB).')
+  parser.add_argument('-g', '--grace', required=False, default='10m',
+      help='The age below which no file is deleted.')
+  parser.add_argument('-s', '--state', required=False,
+      default='compact_frames.json',
+      help='The file the compaction progress is saved to.')
+  parser.add_argument('-i', '--interval', type=float, required=False,
+      help='Run every this many minutes. Runs once if not given.')
+  args = parser.parse_args()
+
+  logging.basicConfig(filename='compact_frames.log', filemode='a',
+      format='%(asctime)s,%(msecs)03d %(name)s %(levelname)s %(message)s',
+          datefmt='%H:%M:%S', level=logging.INFO)
+
+  max_bytes = int(args.budget * (1 << 30)) if args.budget else None
+  retention = webcam.retention.Retention(args.frames,
+      webcam.retention.parse_tiers(args.tiers), max_bytes,
+      webcam.retention.parse_duration(args.grace), args.state)
+  while True:
+    stats = retention.compact()
+    print("thinned %d, evicted %d, orphans %d, %d MB left" % (stats['thinned'],
+        stats['evicted'], stats['orphans'], stats['bytes'] >> 20))
+    if not args.interval:
+      break
+    time.sleep(args.interval * 60)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,154 @@
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import random
+import time
+
+from features.bovw import (CLUSTER_FRAMES_PER_WEBCAM, encode_webcam,
+    init_worker, load_vocabulary, store_mat)
+from webcam.thumbnails import pick_level, thumbnails_directory
+
+# Computes bag-of-visual-words histograms of every frame and every webcam of a
+# frames directory, with a vocabulary generated by the C++ cluster pipeline.
+#
+# Writes <output>/frames/<camera>.npz holding the frame 'names', their
+# 'histograms' and the 'webcam' histogram, and <output>/webcams.npz holding
+# all 'cameras' and their 'histograms'. Webcams that already have a frames
+# file are not computed again unless --overwrite is given.
+#
+# With --cluster-cache, webcams are also described the way COMPLETE
+# (cluster/src/complete.cc) does it, with its own parameters rather than the
+# flags below (see features.bovw.CLUSTER_ENCODER_ARGS), and their raw word
+# counts are written as <cluster-cache>/features/<camera>.yml, which COMPLETE
+# (run from that directory) picks up instead of computing its own features.
+# Like COMPLETE, webcams with fewer than 10 frames get no features. Frames are
+# sampled with a generator seeded by the webcam's name, so the counts are
+# reproducible but not those COMPLETE would draw. Webcams that already have a
+# features file, e.g. from COMPLETE, keep it unless --overwrite is given.
+#
+# Usage Example:
+#   compute_features.py webcam/frames vocabulary.yml.bak features_out -j 8
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("frames_dir", help="Directory containing webcam image folders")
+  parser.add_argument("vocabulary", help="OpenCV YAML file holding the vocabulary matrix")
+  parser.add_argument("output", help="Directory the histograms are written to")
+  parser.add_argument("-j", "--workers", type=int, default=multiprocessing.cpu_count(),
+      help="Number of worker processes")
+  parser.add_argument("--batch-size", type=int, default=16,
+      help="Number of frames whose descriptors are assigned together")
+  parser.add_argument("--frames-per-webcam", type=int, default=0,
+      help="Number of evenly spaced frames encoded per webcam (0 for all)")
+  parser.add_argument("--step", type=int, default=8, help="Dense grid spacing")
+  parser.add_argument("--size", type=int, default=16, help="Dense keypoint diameter")
+  parser.add_argument("--max-side", type=int, default=256,
+      help="Frames are shrunk to this larger side before description (0 keeps them)")
+  parser.add_argument("--max-descriptors", type=int, default=0,
+      help="Maximum number of descriptors per frame (0 for all)")
+  parser.add_argument("--cluster-cache",
+      help="Directory COMPLETE runs in; webcam word counts are stored in its features/")
+  parser.add_argument("--overwrite", action="store_true",
+      help="Recompute webcams that already have histograms")
+  args = parser.parse_args()
+  return args
+
+# Returns the paths to read the frames of a webcam from: thumbnails covering
+# max_side where there are some (see webcam.thumbnails), else full frames.
+def frame_paths(frames_dir, camera, frames_per_webcam, max_side):
+  names = sorted(fn for fn in os.listdir(os.path.join(frames_dir, camera))
+      if fn.endswith('.jpg'))
+  if frames_per_webcam and len(names) > frames_per_webcam:
+    keep = np.linspace(0, len(names) - 1, frames_per_webcam).astype(np.int64)
+    names = [names[i] for i in keep]
+
+  paths = [os.path.join(frames_dir, camera, name) for name in names]
+  level = pick_level(thumbnails_directory(frames_dir), camera, max_side) if max_side else None
+  if level is None:
+    return paths
+  thumbnails = os.path.join(thumbnails_directory(frames_dir), str(level), camera)
+  return [os.path.join(thumbnails, name)
+      if os.path.exists(os.path.join(thumbnails, name)) else path
+      for name, path in zip(names, paths)]
+
+# Returns the full-size frames COMPLETE would describe for a webcam: a uniform
+# sample, with replacement, of CLUSTER_FRAMES_PER_WEBCAM frames, or none if
+# the webcam has fewer frames.
+def cluster_frame_paths(frames_dir, camera):
+  names = sorted(fn for fn in os.listdir(os.path.join(frames_dir, camera))
+      if fn.endswith('.jpg'))
+  if len(names) < CLUSTER_FRAMES_PER_WEBCAM:
+    return []
+  rng = random.Random(camera)
+  return [os.path.join(frames_dir, camera, rng.choice(names))
+      for _ in range(CLUSTER_FRAMES_PER_WEBCAM)]
+
+def save_webcam(path, names, histograms, webcam):
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    np.savez(f, names=np.array(names), histograms=histograms, webcam=webcam)
+  os.rename(tmp_path, path)
+
+def main(args):
+  vocabulary = load_vocabulary(args.vocabulary)
+  frames_out = os.path.join(args.output, 'frames')
+  if not os.path.isdir(frames_out):
+    os.makedirs(frames_out)
+  features_out = os.path.join(args.cluster_cache, 'features') if args.cluster_cache else None
+  if features_out and not os.path.isdir(features_out):
+    os.makedirs(features_out)
+
+  cameras = sorted(fn for fn in os.listdir(args.frames_dir)
+      if os.path.isdir(os.path.join(args.frames_dir, fn)))
+  def needs_frames(camera):
+    return args.overwrite or not os.path.exists(os.path.join(frames_out, camera + '.npz'))
+  def needs_cluster(camera):
+    return features_out is not None and (args.overwrite or
+        not os.path.exists(os.path.join(features_out, camera + '.yml')))
+  todo = [camera for camera in cameras if needs_frames(camera) or needs_cluster(camera)]
+  tasks = ((camera,
+      frame_paths(args.frames_dir, camera, args.frames_per_webcam, args.max_side)
+          if needs_frames(camera) else [],
+      args.batch_size,
+      cluster_frame_paths(args.frames_dir, camera) if needs_cluster(camera) else [])
+      for camera in todo)
+
+  encoder_args = dict(step=args.step, size=args.size, max_side=args.max_side,
+      max_descriptors=args.max_descriptors)
+  pool = multiprocessing.Pool(args.workers, init_worker, (vocabulary, encoder_args))
+  started = time.time()
+  num_frames = 0
+  try:
+    for i, (camera, names, histograms, webcam, cluster_counts) in enumerate(
+        pool.imap_unordered(encode_webcam, tasks)):
+      if needs_frames(camera):
+        save_webcam(os.path.join(frames_out, camera + '.npz'), names, histograms, webcam)
+      if cluster_counts is not None:
+        store_mat(features_out, camera, cluster_counts)
+      num_frames += len(names)
+      print("%d/%d webcams, %d frames, %f frames/s" % (i + 1, len(todo),
+          num_frames, num_frames / max(time.time() - started, 1e-9)))
+  finally:
+    pool.terminate()
+
+  webcams = []
+  histograms = []
+  for camera in cameras:
+    path = os.path.join(frames_out, camera + '.npz')
+    if not os.path.exists(path):
+      continue
+    with np.load(path) as data:
+      if len(data['names']) == 0:
+        continue
+      webcams.append(camera)
+      histograms.append(data['webcam'])
+  histograms = np.array(histograms, dtype=np.float32).reshape(-1, len(vocabulary))
+  with open(os.path.join(args.output, 'webcams.npz'), 'wb') as f:
+    np.savez(f, cameras=np.array(webcams), histograms=histograms)
+  print("%d webcams in %s" % (len(webcams), args.output))
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
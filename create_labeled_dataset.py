@@ -1,14 +1,16 @@
-from detector.Webcam import Webcam
+from classify.cache import perceptual_hash
+from dataset.dedup import DEFAULT_RADIUS, record_index
+from dataset.records import PatchReader, PatchWriter
+from detector.PatchPrefetcher import PatchPrefetcher
+from detector.SnapshotStore import SnapshotStore
+import argparse
+import bisect
 import os
 import cv2
-import sys
 
 frames_dir = 'webcam/frames'
 width = 224
 
-wc_paths = [os.path.join(frames_dir, fn) for fn in os.listdir(frames_dir)]
-
-
 QUIT = 0
 ANIMAL = 1
 NOISE = 2
@@ -27,45 +29,95 @@ KEYS = {
 
 LABELS = {'ANIMAL', 'NOISE', 'HUMAN', 'VEHICLE'}
 
-patch_count = 9780
-def save_patch(patch, label):
-  global patch_count
-  cv2.imwrite(os.path.join('database', label.lower(), str(patch_count) + '.jpg'), patch)
-  print patch_count
-  patch_count += 1
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--records", default="database/records",
+      help="Record directory labeled patches are appended to")
+  parser.add_argument("--start", type=int,
+      help="Index of the first webcam to label. By default, labeling resumes "
+           "after the last labeled frame")
+  parser.add_argument("--prefetch", type=int, default=64,
+      help="Number of patches detected ahead of labeling")
+  parser.add_argument("--dedup-radius", type=int, default=DEFAULT_RADIUS,
+      help="Patches whose perceptual hash is within this many bits of a "
+           "labeled patch are skipped. Negative to show every patch")
+  parser.add_argument("--snapshots",
+      help="Directory of background-model snapshots. Resuming restores the "
+           "model instead of replaying the frames before the last labeled one")
+  args = parser.parse_args()
+  return args
 
+def save_patch(writer, camera, frame, patch, bb, label):
+  patch_id = writer.write(patch, label, camera, frame, bb)
+  print patch_id
+  return patch_id
 
-def process_cam(cam):
+
+def label_patches(writer, prefetcher, first_webcam_no, labeled, radius):
+  webcam_no = None
+  duplicates = 0
   while True:
-    cam.update()
-    patches = cam.patches(squareSize=width)
-    for patch in patches:
-      if patch is not None:
-        cv2.imshow('patch', patch)
-        k = cv2.waitKey(0) & 0xFF
-        if k in KEYS:
-          command = KEYS[k]
-          if command == 'QUIT':
-            sys.exit(0)
-          elif command == 'NEXT':
-            print "PROCESSING NEXT WEBCAM"
-            return
-          elif command in LABELS:
-            print command
-            save_patch(patch, command)
-          else:
-            print 'Unrecognized command'
-            return
-        else:
-          print 'Frame unlabeled.'
+    item = prefetcher.get()
+    if item is None:
+      return
+    cam_no, camera, frame, bb, patch = item
+    if first_webcam_no + cam_no != webcam_no:
+      if webcam_no is not None:
+        print "WEBCAM_NO", webcam_no
+      webcam_no = first_webcam_no + cam_no
+    h = perceptual_hash(patch)
+    if radius >= 0 and labeled.find(h, radius) is not None:
+      duplicates += 1
+      print 'Duplicate patch skipped (%d so far).' % duplicates
+      continue
+    cv2.imshow('patch', patch)
+    k = cv2.waitKey(0) & 0xFF
+    if k in KEYS:
+      command = KEYS[k]
+      if command == 'QUIT':
+        return
+      elif command == 'NEXT':
+        print "PROCESSING NEXT WEBCAM"
+        prefetcher.skipCamera(camera)
+      elif command in LABELS:
+        print command
+        labeled.add(h, save_patch(writer, camera, frame, patch, bb, command))
+      else:
+        print 'Unrecognized command'
+        prefetcher.skipCamera(camera)
+    else:
+      print 'Frame unlabeled.'
+
+
+def main(args):
+  writer = PatchWriter(args.records)
+  wc_paths = sorted(os.path.join(frames_dir, fn) for fn in os.listdir(frames_dir))
+
+  # Resume at the camera of the last labeled patch, after its frame.
+  last_camera, last_frame = None, None
+  webcam_no = 0
+  if args.start is not None:
+    webcam_no = args.start
+  elif writer.last() is not None:
+    last_camera, last_frame = writer.last()
+    webcam_no = bisect.bisect_left(wc_paths, os.path.join(frames_dir, last_camera))
+
+  reader = PatchReader(args.records)
+  labeled = record_index(reader)
+  reader.close()
+
+  # Detection runs ahead in a background thread while patches wait on a key.
+  store = SnapshotStore(args.snapshots) if args.snapshots else None
+  prefetcher = PatchPrefetcher(wc_paths[webcam_no:], width,
+      queueSize=args.prefetch, resumeCamera=last_camera, resumeFrame=last_frame,
+      snapshots=store, resize=(width, width)).start()
+  try:
+    label_patches(writer, prefetcher, webcam_no, labeled, args.dedup_radius)
+  finally:
+    prefetcher.stop()
+    writer.close()
 
 
-webcam_no = 241
-wc_paths = sorted(wc_paths)
-wc_paths = wc_paths[webcam_no:]
-for wc_path in sorted(wc_paths):
-  cam = Webcam(online=False, resize=(width, width), path=wc_path)
-  cam.update()
-  process_cam(cam)
-  print "WEBCAM_NO", webcam_no
-  webcam_no += 1
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
@@ -0,0 +1,113 @@
+import numpy as np
+import os
+
+from classify.cache import perceptual_hash
+
+# Near-duplicate detection for patches, based on the 64-bit perceptual hashes
+# of classify.cache.perceptual_hash. Patches of a static scene cropped from
+# consecutive frames hash to within a few bits of each other.
+
+# Default number of differing hash bits up to which two patches are
+# considered duplicates.
+DEFAULT_RADIUS = 4
+
+def hamming_distance(a, b):
+  return bin(a ^ b).count('1')
+
+# BK-tree over hashes: every child of a node is filed under its Hamming
+# distance to the node, so by the triangle inequality a query within radius r
+# of `h` only descends into children filed under d - r .. d + r, where d is
+# the distance of `h` to the node. For small radii that visits a small
+# fraction of the tree.
+class BKTree(object):
+  def __init__(self):
+    self.hashes_ = []
+    self.values_ = []
+    self.children_ = []
+
+  def __len__(self):
+    return len(self.hashes_)
+
+  def add(self, h, value=None):
+    h = int(h)
+    node = len(self.hashes_)
+    self.hashes_.append(h)
+    self.values_.append(value)
+    self.children_.append({})
+    if node == 0:
+      return
+    parent = 0
+    while True:
+      d = hamming_distance(h, self.hashes_[parent])
+      child = self.children_[parent].get(d)
+      if child is None:
+        self.children_[parent][d] = node
+        return
+      parent = child
+
+  # Returns [(distance, value)] for every hash within `radius` bits of `h`.
+  def query(self, h, radius=DEFAULT_RADIUS):
+    h = int(h)
+    found = []
+    pending = [0] if self.hashes_ else []
+    while pending:
+      node = pending.pop()
+      d = hamming_distance(h, self.hashes_[node])
+      if d <= radius:
+        found.append((d, self.values_[node]))
+      for k, child in self.children_[node].items():
+        if d - radius <= k <= d + radius:
+          pending.append(child)
+    return found
+
+  # Returns the value of some hash within `radius` bits of `h`, or None.
+  def find(self, h, radius=DEFAULT_RADIUS):
+    h = int(h)
+    pending = [0] if self.hashes_ else []
+    while pending:
+      node = pending.pop()
+      d = hamming_distance(h, self.hashes_[node])
+      if d <= radius:
+        return self.values_[node]
+      for k, child in self.children_[node].items():
+        if d - radius <= k <= d + radius:
+          pending.append(child)
+    return None
+
+# Returns (hashes, valid): a uint64 array with the perceptual hash of every
+# patch of the record directory open in `reader` (see dataset.records), and a
+# bool array that is False for patches that do not decode, whose hash is
+# meaningless. Both are cached in <directory>/hashes.npz; records are
+# append-only, so only patches added since the last call are decoded.
+def record_hashes(reader):
+  path = os.path.join(reader.directory_, 'hashes.npz')
+  hashes = np.zeros(0, np.uint64)
+  valid = np.zeros(0, bool)
+  if os.path.exists(path):
+    with np.load(path) as data:
+      hashes = data['hashes'][:len(reader)]
+      valid = data['valid'][:len(reader)]
+  if len(hashes) < len(reader):
+    new = np.zeros(len(reader) - len(hashes), np.uint64)
+    decoded = np.zeros(len(new), bool)
+    for i in range(len(new)):
+      patch = reader.decode(len(hashes) + i)
+      if patch is not None:
+        new[i] = perceptual_hash(patch)
+        decoded[i] = True
+    hashes = np.concatenate([hashes, new])
+    valid = np.concatenate([valid, decoded])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, hashes=hashes, valid=valid)
+    os.rename(tmp_path, path)
+  return hashes, valid
+
+# Returns a BKTree of the patches of `reader` that decode, with patch ids as
+# values.
+def record_index(reader):
+  tree = BKTree()
+  hashes, valid = record_hashes(reader)
+  for patch_id in np.flatnonzero(valid):
+    tree.add(hashes[patch_id], int(patch_id))
+  return tree
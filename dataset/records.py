@@ -0,0 +1,184 @@
+import cv2
+import errno
+import fcntl
+import mmap
+import numpy as np
+import os
+
+# Labeled patches stored as JPEG bytes appended to a few large shard files,
+# with a fixed-size binary index. Reading a patch costs one slice of a memory
+# mapped shard instead of opening a file, and the index can be memory mapped
+# and filtered with numpy (e.g. by label or camera) without touching shards.
+#
+# Directory layout:
+#   index.bin       : one INDEX_DTYPE record per patch; a patch's id is its row
+#   shard-NNNNN.rec : concatenated encoded patches
+#   lock            : held (flock) by the single PatchWriter allowed at a time
+#
+# A patch's bytes are flushed to its shard before its index record is
+# appended, so after a crash the index never points at missing bytes. Torn
+# index records and unindexed shard bytes are dropped when the next writer
+# opens the directory, and ids keep counting from the index length.
+
+LABELS = ['animal', 'human', 'noise', 'vehicle']
+LABEL_INDEX = {label:i for i, label in enumerate(LABELS)}
+
+INDEX_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('label', 'u1'),
+    ('camera', 'S32'),      # frame directory name, e.g. insecam_00000123
+    ('timestamp', 'S19'),   # frame file name without extension
+    ('bbox', '<i4', (4,)),  # x, y, width, height in the detector's image
+    ('shard', '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+])
+
+INDEX_NAME = 'index.bin'
+
+def shard_path(directory, shard):
+  return os.path.join(directory, 'shard-%05d.rec' % shard)
+
+def read_index(directory):
+  path = os.path.join(directory, INDEX_NAME)
+  if not os.path.exists(path):
+    return np.zeros(0, INDEX_DTYPE)
+  count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+  if count == 0:
+    return np.zeros(0, INDEX_DTYPE)
+  return np.memmap(path, INDEX_DTYPE, 'r', shape=(count,))
+
+# Appends patches to a record directory. Only one writer may have a directory
+# open; a second one fails with IOError instead of interleaving records.
+class PatchWriter(object):
+  def __init__(self, directory, shard_bytes=256 << 20, jpeg_quality=95):
+    self.directory_ = directory
+    self.shard_bytes_ = shard_bytes
+    self.jpeg_quality_ = jpeg_quality
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    self.lock_ = open(os.path.join(directory, 'lock'), 'a')
+    try:
+      fcntl.flock(self.lock_, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+      self.lock_.close()
+      if e.errno in (errno.EAGAIN, errno.EACCES):
+        raise IOError('%s is being written by another process.' % directory)
+      raise
+
+    index_path = os.path.join(directory, INDEX_NAME)
+    self.index_ = open(index_path, 'ab')
+    size = os.path.getsize(index_path)
+    self.index_.truncate(size - size % INDEX_DTYPE.itemsize)
+    self.index_.seek(0, os.SEEK_END)
+    index = read_index(directory)
+    self.next_id_ = len(index)
+
+    if len(index):
+      last = index[-1]
+      self.last_ = (last['camera'].decode(), last['timestamp'].decode())
+      self.shard_ = int(last['shard'])
+      end = int(last['offset']) + int(last['length'])
+    else:
+      self.last_ = None
+      self.shard_ = 0
+      end = 0
+    del index
+    self.shard_file_ = open(shard_path(directory, self.shard_), 'ab')
+    self.shard_file_.truncate(end)
+    self.shard_file_.seek(0, os.SEEK_END)
+
+  def __len__(self):
+    return self.next_id_
+
+  # (camera, timestamp) of the last patch written, or None if there is none.
+  def last(self):
+    return self.last_
+
+  # Encodes `patch` as JPEG and appends it. Returns its id.
+  def write(self, patch, label, camera='', timestamp='', bbox=(0, 0, 0, 0)):
+    ok, encoded = cv2.imencode('.jpg', patch,
+        [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality_])
+    if not ok:
+      raise ValueError('Could not encode patch.')
+    return self.write_encoded(encoded.tobytes(), label, camera, timestamp, bbox)
+
+  # Appends already encoded image bytes. Returns their id.
+  def write_encoded(self, data, label, camera='', timestamp='', bbox=(0, 0, 0, 0)):
+    if self.shard_file_.tell() > 0 and \
+        self.shard_file_.tell() + len(data) > self.shard_bytes_:
+      self.shard_file_.close()
+      self.shard_ += 1
+      self.shard_file_ = open(shard_path(self.directory_, self.shard_), 'ab')
+      self.shard_file_.truncate(0)
+      self.shard_file_.seek(0, os.SEEK_END)
+
+    offset = self.shard_file_.tell()
+    self.shard_file_.write(data)
+    self.shard_file_.flush()
+    os.fsync(self.shard_file_.fileno())
+
+    record = np.zeros(1, INDEX_DTYPE)
+    record['id'] = self.next_id_
+    record['label'] = LABEL_INDEX[label.lower()]
+    record['camera'] = camera.encode()
+    record['timestamp'] = timestamp.encode()
+    record['bbox'] = bbox
+    record['shard'] = self.shard_
+    record['offset'] = offset
+    record['length'] = len(data)
+    self.index_.write(record.tobytes())
+    self.index_.flush()
+    os.fsync(self.index_.fileno())
+
+    self.last_ = (camera, timestamp)
+    self.next_id_ += 1
+    return self.next_id_ - 1
+
+  def close(self):
+    self.shard_file_.close()
+    self.index_.close()
+    fcntl.flock(self.lock_, fcntl.LOCK_UN)
+    self.lock_.close()
+
+# Random access to the patches of a record directory. Safe to share between
+# threads; reopen it in forked processes. Patches appended after the reader
+# was opened are not visible.
+class PatchReader(object):
+  def __init__(self, directory):
+    self.directory_ = directory
+    self.index_ = read_index(directory)
+    self.shards_ = {}
+
+  def __len__(self):
+    return len(self.index_)
+
+  # The memory-mapped INDEX_DTYPE records, one per patch.
+  def index(self):
+    return self.index_
+
+  def labels(self):
+    return np.asarray(self.index_['label'], dtype=np.int64)
+
+  def shard(self, shard):
+    if shard not in self.shards_:
+      with open(shard_path(self.directory_, shard), 'rb') as f:
+        self.shards_[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return self.shards_[shard]
+
+  # Encoded bytes of patch `patch_id`.
+  def read(self, patch_id):
+    record = self.index_[patch_id]
+    offset = int(record['offset'])
+    return self.shard(int(record['shard']))[offset:offset + int(record['length'])]
+
+  # Decoded BGR patch `patch_id`, or None if it can not be decoded.
+  def decode(self, patch_id):
+    data = np.frombuffer(self.read(patch_id), dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+  def close(self):
+    for shard in self.shards_.values():
+      shard.close()
+    self.shards_ = {}
@@ -0,0 +1,96 @@
+#! /bin/python3.5
+
+import argparse
+import collections
+import glob
+import hashlib
+import logging
+import os
+
+import webcam.webcam
+
+
+def dedup_frames(frames_directory, min_cameras, drop_placeholders):
+  """Moves already scraped frames to content-addressed storage.
+
+  Every frame becomes a hard link to its object (see
+  webcam.webcam.object_path), so identical frames share one copy on disk.
+  Frames that are already linked to their object are skipped, so the job can
+  be rerun.
+
+  Args:
+    frames_directory (str): The directory of per-webcam frame directories.
+    min_cameras (int): Digests served by at least this many webcams are
+        reported as likely placeholders.
+    drop_placeholders (bool): When true, frames listed in placeholders.txt
+        are deleted.
+  """
+  logger = logging.getLogger('dedup_frames')
+  tmp_directory = "%s/tmp/" % webcam.webcam.data_directory()
+  os.makedirs(tmp_directory, exist_ok=True)
+  placeholders = webcam.webcam.placeholders()
+  cameras = collections.defaultdict(set)
+  num_frames = 0
+  num_linked = 0
+  num_dropped = 0
+  bytes_saved = 0
+
+  for path in sorted(glob.glob("%s/*/*.jpg" % frames_directory)):
+    num_frames += 1
+    with open(path, 'rb') as f:
+      digest = hashlib.sha1(f.read()).hexdigest()
+    camera = os.path.basename(os.path.dirname(path))
+    cameras[digest].add(camera)
+
+    if drop_placeholders and digest in placeholders:
+      os.remove(path)
+      num_dropped += 1
+      continue
+
+    object_path = webcam.webcam.object_path(digest)
+    if not os.path.exists(object_path):
+      os.makedirs(os.path.dirname(object_path), exist_ok=True)
+      webcam.webcam.link_frame(path, object_path,
+          "%s%s.jpg" % (tmp_directory, digest))
+      continue
+    if os.path.samefile(path, object_path):
+      continue
+    bytes_saved += os.path.getsize(path)
+    webcam.webcam.link_frame(object_path, path,
+        "%s%s_%s" % (tmp_directory, camera, os.path.basename(path)))
+    num_linked += 1
+
+  logger.info("%d frames, %d distinct, %d linked (%d MB saved), %d dropped.",
+      num_frames, len(cameras), num_linked, bytes_saved >> 20, num_dropped)
+  shared = [(len(c), digest) for digest, c in cameras.items()
+      if len(c) >= min_cameras]
+  for num_cameras, digest in sorted(shared, reverse=True):
+    print("%s %d cameras" % (digest, num_cameras))
+
+
+def main():
+  """Moves already scraped frames to content-addressed storage.
+
+  Prints the digests of frames served by several webcams, which are likely
+  placeholders; lines of this output can be appended to
+  webcam/placeholders.txt.
+
+  Usage Example:
+    dedup_frames.py --min-cameras 5 --drop-placeholders
+  """
+  parser = argparse.ArgumentParser(prog='dedup_frames')
+  parser.add_argument('-f', '--frames', required=False,
+      default="%s/frames" % webcam.webcam.data_directory(),
+      help='The directory of per-webcam frame directories.')
+  parser.add_argument('-m', '--min-cameras', type=int, required=False,
+      default=3, help='Report digests served by at least this many webcams.')
+  parser.add_argument('-d', '--drop-placeholders', action='store_true',
+      required=False, help='Delete frames listed in placeholders.txt.')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  dedup_frames(args.frames, args.min_cameras, args.drop_placeholders)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,68 @@
+import argparse
+import numpy as np
+import time
+
+from dataset.dedup import DEFAULT_RADIUS, BKTree, record_hashes
+from dataset.records import LABELS, PatchReader, PatchWriter
+
+# Copies a record directory (see dataset/records.py) without its
+# near-duplicate patches: a patch is dropped if its perceptual hash is within
+# --radius bits of a patch with the same label that was kept before it.
+# Patches that do not decode are kept as they are, never as duplicates.
+#
+# Usage Example:
+#   dedup_patches.py database/records database/records_dedup
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("records", help="Record directory to deduplicate")
+  parser.add_argument("output", nargs="?",
+      help="Record directory the kept patches are appended to. Without it, "
+           "duplicates are only counted")
+  parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS,
+      help="Maximum number of differing hash bits of near-duplicates")
+  args = parser.parse_args()
+  return args
+
+def main(args):
+  reader = PatchReader(args.records)
+  started = time.time()
+  hashes, valid = record_hashes(reader)
+  print "hashed %d patches in %f s (%d do not decode)" % (len(hashes),
+      time.time() - started, (~valid).sum())
+
+  started = time.time()
+  index = reader.index()
+  trees = dict((label, BKTree()) for label in range(len(LABELS)))
+  keep = np.zeros(len(reader), dtype=bool)
+  for patch_id, h in enumerate(hashes):
+    if not valid[patch_id]:
+      keep[patch_id] = True
+      continue
+    tree = trees[int(index['label'][patch_id])]
+    if tree.find(h, args.radius) is None:
+      tree.add(h, patch_id)
+      keep[patch_id] = True
+  print "indexed in %f s" % (time.time() - started)
+
+  labels = reader.labels()
+  for i, label in enumerate(LABELS):
+    total = (labels == i).sum()
+    print "%s: kept %d of %d" % (label, (keep & (labels == i)).sum(), total)
+
+  if args.output:
+    writer = PatchWriter(args.output)
+    try:
+      for patch_id in np.flatnonzero(keep):
+        record = index[patch_id]
+        writer.write_encoded(reader.read(patch_id), LABELS[record['label']],
+            record['camera'].decode(), record['timestamp'].decode(),
+            record['bbox'])
+    finally:
+      writer.close()
+    print "%d patches in %s" % (len(writer), args.output)
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
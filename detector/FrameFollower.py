@@ -0,0 +1,101 @@
+##### Follows frames as the scraper writes them to disk #####
+### Class constructor ###
+# FrameFollower(framesDir, cursorPath, cameras = None, skipDuplicates = True)
+# ----- Arguments -----
+# framesDir (required)  : Directory containing one folder of timestamped frames per webcam (e.g. webcam/frames)
+# cursorPath (required) : JSON file mapping each webcam folder to the name of the last frame that was processed. Loaded if it exists
+# cameras (optional)    : List of webcam folder names to follow. By default, every folder in framesDir is followed, including ones created later
+# skipDuplicates (optional) : input True to skip frames that are hard links to the same file as the previous frame of their webcam, i.e. frames
+#                         the scraper stored by content and found identical (see webcam.webcam.object_path). Skipped frames are committed without
+#                         being processed and counted in duplicateFrames. By default, set to True
+#
+### Instance Methods ###
+# poll()                  : Returns a list of (camera, framePath) for frames newer than each camera's cursor, oldest first within a camera.
+#               Folders whose modification time has not changed since the last poll are not listed again (unless it changed within the last
+#               few seconds, where coarse file system timestamps could hide a frame written right after the listing).
+# commit(camera, framePath) : Advances the camera's cursor to framePath. Frames are not returned by poll() again once committed
+# save()                  : Writes the cursors to cursorPath. The file is written to a temporary name and renamed, so it is never left half written
+# follow(process, pollInterval = 5, maxPolls = None)
+#                         : Calls process(camera, framePath) for every new frame (except skipped duplicates), committing each frame after
+#               process returns and saving the cursors after every poll. Sleeps pollInterval seconds when there is nothing new. Stops after maxPolls polls if given.
+#
+# A frame whose processing was interrupted by a crash, before its cursor was saved, is processed again after a restart.
+# Frame names are timestamps (see webcam.webcam.Webcam.fetch_current_frame), so name order is chronological.
+#
+
+import json
+import os
+import time
+
+class FrameFollower:
+  def __init__(self, framesDir, cursorPath, cameras = None, skipDuplicates = True):
+    self.framesDir = framesDir
+    self.cursorPath = cursorPath
+    self.cameras = cameras
+    self.skipDuplicates = skipDuplicates
+    self.duplicateFrames = 0
+    self.cursors = {}
+    self.mtimes = {}
+    self.lastFiles = {}
+    self.dirty = False
+
+    if os.path.exists(cursorPath):
+      with open(cursorPath) as f:
+        self.cursors = json.load(f)
+
+  def poll(self):
+    cameras = self.cameras if self.cameras is not None else sorted(os.listdir(self.framesDir))
+    frames = []
+    for camera in cameras:
+      camDir = os.path.join(self.framesDir, camera)
+      try:
+        mtime = os.stat(camDir).st_mtime
+      except OSError:
+        continue
+      if self.mtimes.get(camera) == mtime:
+        continue
+
+      cursor = self.cursors.get(camera, '')
+      names = sorted(fn for fn in os.listdir(camDir) if fn.endswith('.jpg') and fn > cursor)
+      frames.extend((camera, os.path.join(camDir, fn)) for fn in names)
+      if time.time() - mtime > 2:
+        self.mtimes[camera] = mtime
+    return frames
+
+  def commit(self, camera, framePath):
+    self.cursors[camera] = os.path.basename(framePath)
+    self.dirty = True
+
+  def save(self):
+    if not self.dirty:
+      return
+    tmpPath = self.cursorPath + '.tmp'
+    with open(tmpPath, 'w') as f:
+      json.dump(self.cursors, f)
+    os.rename(tmpPath, self.cursorPath)
+    self.dirty = False
+
+  def follow(self, process, pollInterval = 5, maxPolls = None):
+    polls = 0
+    while maxPolls is None or polls < maxPolls:
+      frames = self.poll()
+      for camera, framePath in frames:
+        if self.skipDuplicates and self._duplicate(camera, framePath):
+          self.duplicateFrames += 1
+        else:
+          process(camera, framePath)
+        self.commit(camera, framePath)
+      self.save()
+      polls += 1
+      if not frames:
+        time.sleep(pollInterval)
+
+  def _duplicate(self, camera, framePath):
+    try:
+      st = os.stat(framePath)
+    except OSError:
+      return False
+    fileId = (st.st_dev, st.st_ino)
+    duplicate = self.lastFiles.get(camera) == fileId
+    self.lastFiles[camera] = fileId
+    return duplicate
@@ -0,0 +1,115 @@
+##### Runs detection ahead of an interactive consumer of patches #####
+### Class constructor ###
+# PatchPrefetcher(camPaths, squareSize, queueSize = 64, resumeCamera = None, resumeFrame = None, snapshots = None, **webcamArgs)
+# ----- Arguments -----
+# camPaths (required)     : List of webcam frame folders to read, in order
+# squareSize (required)   : Side of the square patches, as in Webcam.patches(squareSize)
+# queueSize (optional)    : Maximum number of ready patches held ahead of the consumer. By default, set to 64
+# resumeCamera (optional) : Name of the folder in which to skip frames up to and including resumeFrame. Skipped frames still go through
+#                           the background subtractor, so detection resumes with a warm model
+# resumeFrame (optional)  : Frame name (file name without extension) to resume after
+# snapshots (optional)    : SnapshotStore keyed by folder name. When resumeCamera has a snapshot, its background model is restored and reading
+#                           jumps past resumeFrame instead of replaying the skipped frames. The model of every folder is saved when the thread
+#                           leaves it
+# webcamArgs (optional)   : Passed on to the offline Webcam of every folder (e.g. resize)
+#
+### Instance Methods ###
+# start()              : Starts the background thread. Returns the prefetcher
+# get()                : Blocks until the next patch is ready and returns (camNo, camera, frame, bb, patch), or None once every folder is done.
+#               camNo is the index of the folder in camPaths, camera its name, frame the frame name and bb the (x, y, w, h) bounding box.
+# skipCamera(camera)   : Drops the remaining patches of camera. The thread stops reading the folder as soon as it notices
+# stop()               : Stops the background thread and waits for it
+#
+# The thread opens each Webcam, reads its frames and crops patches while the consumer waits on user input, so the consumer only
+# waits when it labels faster than detection runs. Patches are copied before they are queued.
+#
+
+import Queue
+import bisect
+import os
+import threading
+
+from detector.Webcam import Webcam
+
+class PatchPrefetcher:
+  def __init__(self, camPaths, squareSize, queueSize = 64, resumeCamera = None, resumeFrame = None, snapshots = None, **webcamArgs):
+    self.camPaths = camPaths
+    self.squareSize = squareSize
+    self.resumeCamera = resumeCamera
+    self.resumeFrame = resumeFrame
+    self.snapshots = snapshots
+    self.webcamArgs = webcamArgs
+    self.queue = Queue.Queue(maxsize = queueSize)
+    self.skipped = set()
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target = self._run)
+    self.thread.daemon = True
+
+  def start(self):
+    self.thread.start()
+    return self
+
+  def get(self):
+    while True:
+      item = self.queue.get()
+      if item is None or item[1] not in self.skipped:
+        return item
+
+  def skipCamera(self, camera):
+    self.skipped.add(camera)
+
+  def stop(self):
+    self.stopped.set()
+    # Unblock a put() waiting on a full queue.
+    while self.thread.is_alive():
+      try:
+        self.queue.get(timeout = 0.1)
+      except Queue.Empty:
+        pass
+    self.thread.join()
+
+  def _put(self, item):
+    while not self.stopped.is_set():
+      try:
+        self.queue.put(item, timeout = 0.1)
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def _run(self):
+    for camNo, camPath in enumerate(self.camPaths):
+      camera = os.path.basename(camPath)
+      cam = Webcam(online = False, path = camPath, **self.webcamArgs)
+      if camera == self.resumeCamera and self.snapshots is not None and self.snapshots.load(camera, cam):
+        names = [os.path.splitext(os.path.basename(path))[0] for path in cam.frame_paths]
+        cam.imgIdx = bisect.bisect_right(names, self.resumeFrame)
+      else:
+        cam.update()
+        if camera == self.resumeCamera:
+          while cam.imgIdx < len(cam.frame_paths) and self._frameName(cam) < self.resumeFrame:
+            cam.update()
+
+      finished = self._detect(camNo, camera, cam)
+      if self.snapshots is not None and cam.hasImg:
+        self.snapshots.save(camera, cam)
+      if not finished:
+        return
+    self._put(None)
+
+  # Queues the patches of the remaining frames of cam. Returns False if the prefetcher was stopped.
+  def _detect(self, camNo, camera, cam):
+    while camera not in self.skipped and not self.stopped.is_set():
+      if cam.imgIdx >= len(cam.frame_paths):
+        break
+      cam.update()
+      if not cam.hasImg:
+        continue
+      frame = self._frameName(cam)
+      for patch, bb in zip(cam.patches(squareSize = self.squareSize), cam.bb):
+        if not self._put((camNo, camera, frame, bb, patch.copy())):
+          return False
+    return not self.stopped.is_set()
+
+  def _frameName(self, cam):
+    return os.path.splitext(os.path.basename(cam.frame_paths[cam.imgIdx - 1]))[0]
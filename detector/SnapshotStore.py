@@ -0,0 +1,53 @@
+##### On-disk store of Webcam background-model snapshots #####
+### Class constructor ###
+# SnapshotStore(directory)
+# ----- Arguments -----
+# directory (required) : Directory holding one compressed <key>.npz file per webcam. Created if it does not exist
+#
+### Instance Methods ###
+# save(key, webcam)    : Saves webcam.snapshot() under key. The file is written to a temporary name and renamed, so readers never see partial snapshots
+# load(key, webcam)    : Restores the webcam from the snapshot saved under key. Returns False if there is no such snapshot
+#
+### Functions ###
+# warmUp(webcam, store, key, numUpdates) : Restores the webcam from the store and calls update() once, or, if there is no snapshot (or no store),
+#               calls update() numUpdates times. In both cases the resulting snapshot is saved back to the store. Returns True if a snapshot was restored.
+#
+
+import numpy as np
+import os
+
+class SnapshotStore:
+  def __init__(self, directory):
+    self.directory = directory
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def path(self, key):
+    return os.path.join(self.directory, key + '.npz')
+
+  def save(self, key, webcam):
+    snapshot = webcam.snapshot()
+    tmpPath = self.path(key) + '.tmp'
+    with open(tmpPath, 'wb') as f:
+      np.savez_compressed(f,
+                          background = snapshot['background'],
+                          history = np.int64(snapshot['history']),
+                          varThreshold = np.float64(snapshot['varThreshold']),
+                          modelFrames = np.int64(snapshot['modelFrames']),
+                          lastFrame = np.array(snapshot['lastFrame']))
+    os.rename(tmpPath, self.path(key))
+
+  def load(self, key, webcam):
+    if not os.path.exists(self.path(key)):
+      return False
+    with np.load(self.path(key)) as data:
+      webcam.restore(dict((name, data[name]) for name in data.files))
+    return True
+
+def warmUp(webcam, store, key, numUpdates):
+  restored = store is not None and store.load(key, webcam)
+  for i in range(1 if restored else numUpdates):
+    webcam.update()
+  if store is not None and webcam.hasImg:
+    store.save(key, webcam)
+  return restored
@@ -0,0 +1,126 @@
+##### Multi-object tracker for Webcam bounding boxes #####
+### Class constructor ###
+# Tracker(iouThreshold = 0.3, maxMissed = 5, changeThreshold = 0.5, refreshInterval = 50, velocitySmoothing = 0.5)
+# ----- Arguments -----
+# iouThreshold (optional)     : Minimum intersection over union between a box and a track's predicted box for them to match. By default, set to 0.3
+# maxMissed (optional)        : Number of consecutive updates a track may go unmatched before it is dropped. By default, set to 5
+# changeThreshold (optional)  : A matched box whose intersection over union with the box the track was last classified at falls below this
+#                               is reported as changed. By default, set to 0.5
+# refreshInterval (optional)  : Number of updates after which a track is reported as changed again even if it did not move. By default, set to 50
+# velocitySmoothing (optional): Weight of the previous velocity in the exponential average of a track's velocity. By default, set to 0.5
+#
+### Instance Methods ###
+# update(boxes)                   : Matches a list of (x, y, w, h) boxes to the current tracks and returns (ids, changed), two lists aligned with boxes.
+#               ids[i] is the track id of boxes[i]. changed[i] is True if boxes[i] starts a new track, has never been classified, moved or
+#               resized substantially since it was last classified, or was last classified refreshInterval or more updates ago.
+# markClassified(trackId, result) : Records result as the classification of the track at its current box.
+# result(trackId)                 : Returns the last result recorded with markClassified, or None.
+# age(trackId)                    : Returns the number of updates since the track was created.
+# velocity(trackId)               : Returns the smoothed (dx, dy) motion of the track's center, in pixels per update.
+# tracks()                        : Returns the ids of all live tracks.
+#
+### Functions ###
+# iou(a, b) : Returns the (N, M) matrix of intersection over union between the (x, y, w, h) rows of a (N x 4) and b (M x 4).
+#
+
+import numpy as np
+
+def iou(a, b):
+  a = np.asarray(a, dtype = np.float64).reshape(-1, 4)
+  b = np.asarray(b, dtype = np.float64).reshape(-1, 4)
+  left = np.maximum(a[:, None, 0], b[None, :, 0])
+  top = np.maximum(a[:, None, 1], b[None, :, 1])
+  right = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+  bottom = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+  intersection = np.maximum(right - left, 0)*np.maximum(bottom - top, 0)
+  union = (a[:, 2]*a[:, 3])[:, None] + (b[:, 2]*b[:, 3])[None, :] - intersection
+  return intersection/np.maximum(union, 1e-9)
+
+class Track:
+  def __init__(self, trackId, box):
+    self.id = trackId
+    self.box = np.asarray(box, dtype = np.float64)
+    self.velocity = np.zeros(2)
+    self.age = 0
+    self.missed = 0
+    self.classifiedBox = None
+    self.classifiedAge = 0
+    self.result = None
+
+  def predicted(self):
+    return self.box + np.array([self.velocity[0], self.velocity[1], 0, 0])
+
+class Tracker:
+  def __init__(self, iouThreshold = 0.3, maxMissed = 5, changeThreshold = 0.5, refreshInterval = 50, velocitySmoothing = 0.5):
+    self.iouThreshold = iouThreshold
+    self.maxMissed = maxMissed
+    self.changeThreshold = changeThreshold
+    self.refreshInterval = refreshInterval
+    self.velocitySmoothing = velocitySmoothing
+    self.nextId = 0
+    self.live = []
+    self.byId = {}
+
+  def update(self, boxes):
+    boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+    trackOf = [None]*len(boxes)
+
+    if self.live and len(boxes):
+      overlaps = iou([t.predicted() for t in self.live], boxes)
+      rows, cols = np.nonzero(overlaps >= self.iouThreshold)
+      order = np.argsort(-overlaps[rows, cols], kind = 'mergesort')
+      matchedTracks = set()
+      for r, c in zip(rows[order], cols[order]):
+        if r not in matchedTracks and trackOf[c] is None:
+          matchedTracks.add(r)
+          trackOf[c] = self.live[r]
+
+    for track in self.live:
+      track.age += 1
+      track.missed += 1
+
+    for i, box in enumerate(boxes):
+      track = trackOf[i]
+      if track is None:
+        track = Track(self.nextId, box)
+        self.nextId += 1
+        self.live.append(track)
+        self.byId[track.id] = track
+        trackOf[i] = track
+      else:
+        shift = (box[0:2] + box[2:4]/2.0) - (track.box[0:2] + track.box[2:4]/2.0)
+        track.velocity = self.velocitySmoothing*track.velocity + (1 - self.velocitySmoothing)*shift
+        track.box = box
+      track.missed = 0
+
+    dropped = [t for t in self.live if t.missed > self.maxMissed]
+    for track in dropped:
+      del self.byId[track.id]
+    self.live = [t for t in self.live if t.missed <= self.maxMissed]
+
+    return [t.id for t in trackOf], [self._changed(t) for t in trackOf]
+
+  def _changed(self, track):
+    if track.classifiedBox is None:
+      return True
+    if track.age - track.classifiedAge >= self.refreshInterval:
+      return True
+    return iou(track.box, track.classifiedBox)[0, 0] < self.changeThreshold
+
+  def markClassified(self, trackId, result):
+    track = self.byId[trackId]
+    track.classifiedBox = track.box.copy()
+    track.classifiedAge = track.age
+    track.result = result
+
+  def result(self, trackId):
+    return self.byId[trackId].result
+
+  def age(self, trackId):
+    return self.byId[trackId].age
+
+  def velocity(self, trackId):
+    return tuple(self.byId[trackId].velocity)
+
+  def tracks(self):
+    return [t.id for t in self.live]
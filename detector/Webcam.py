@@ -1,6 +1,6 @@
 ##### Webcam Object for object detection and tracking #####
 ### Class constructor ###
-# Webcam(online,path,resize = None,BSHistory = 50, BSThreshold = 15, minBlobAreaRatio = 0.0003, maxBlobAreaRatio = 0.2)
+# Webcam(online,path,resize = None,BSHistory = 50, BSThreshold = 15, minBlobAreaRatio = 0.0003, maxBlobAreaRatio = 0.2, motionGate = False, gateThreshold = 2.0, gateSize = 32, tracker = None, thumbnails = True)
 # ----- Arguments -----
 # online (required)          : input True if image source is an online webcam, input False if image source is images in a folder
 # path   (required)          : query URL if image source is an online webcam, image directory path is image source is images in a folder
@@ -9,9 +9,23 @@
 # BSThreshold (optional)     : Controls the threshold above which the background subtractor classifies a pixel as foreground. By default, set to 15
 # minBlobAreaRatio (optional): Minimum percentage of picture area a blob must be to be classified as foreground. By default, set to 0.0003
 # maxBlobAreaRatio (optional): Maximum percentage of picture area a blob must be to be classified as background. By default, set to 0.15
+# motionGate (optional)      : input True to skip detection on frames that barely differ from the last processed frame. By default, no frames are skipped
+#                              Skipped frames keep the previous detection results. Before the next processed frame, the last skipped frame is applied to the
+#                              background subtractor with the learning rate accumulated over the skipped frames, so the background model ages as if none were
+#                              skipped. The processed frame itself is applied at the normal one-frame rate, so moving objects in it are not absorbed.
+# gateThreshold (optional)   : Mean absolute grayscale difference (0-255) on the downsampled frame below which a frame is skipped. By default, set to 2.0
+# gateSize (optional)        : Side of the square thumbnail the motion gate compares. By default, set to 32
+# tracker (optional)         : A Tracker that gives bounding boxes stable ids across frames. By default, boxes are not tracked
+#                              After each update(), trackIds[i] is the track id of bb[i] and changedTracks[i] tells whether bb[i] needs classifying again.
+#                              filtered_overlay() then only classifies changed boxes and reuses the last result for the others.
+# thumbnails (optional)      : For image folders read with resize, input True to read frames from the thumbnail pyramid written at ingest
+#                              (see webcam.thumbnails) instead of decoding full frames. The smallest level whose short side covers the
+#                              larger side of resize is used; frames without a thumbnail are read in full. By default, set to True
 #
 ### Instance Methods ###
 # update()                  : Call this function to get a new image from image source and process it.
+#                             processedFrames and gatedFrames count how many frames went through detection and how many were skipped by the motion gate.
+# feed(image)               : Processes an image obtained elsewhere (e.g. by FrameFollower) exactly as update() processes the images it reads.
 # score()                   : Call this function to get the current image score for the webcam.
 # image()                   : Returns most recent image of webcam (in the form of a numpy array)
 # overlaidImage()           : Returns most recent image of webcam overlaid with object detection contours and bounding boxes
@@ -20,10 +34,21 @@
 # patches(squareSize, num)  : Returns list of images from bounding boxes of detected objects. Returns an empty list if no objects are detected.
 #               If the optional squareSize argument is provided, images are resized to be of size squareSize x squareSize. By default, images are not resized
 #               If the optional num argument is provided, up to num number of images are returned. By default, all images are returned in the list.
+# patchBatch(squareSize, num, out, padSquare, context)
+#                           : Returns a (N, squareSize, squareSize, 3) uint8 array holding the resized patches of the first N bounding boxes.
+#               The array is written in place, either into the optional out array or into a buffer owned by the webcam that is reused across calls,
+#               so copy it if it must outlive the next call.
+#               If the optional padSquare argument is True, bounding boxes are grown to a square around their center before cropping, so patches are not stretched.
+#               If the optional context argument is provided, bounding boxes are grown by that fraction of their size on every side.
+#               Regions falling outside the image are padded with black.
+# snapshot()                : Returns a dict holding the background image, the background subtractor parameters and, for image folders, the last frame read.
+# restore(snapshot)         : Rebuilds the background subtractor from a dict returned by snapshot(), so the webcam does not need warm-up frames.
+#               For image folders, reading resumes after the last frame recorded in the snapshot. See SnapshotStore for persisting snapshots.
 #
 
 import cv2
 import numpy as np
+import bisect
 import time
 import urllib2
 import httplib
@@ -31,13 +56,31 @@ from socket import timeout
 from skimage import io
 import os
 
+from classify.rules import decide
+from webcam.thumbnails import pick_level, thumbnails_directory
+
 class Webcam:
-  def __init__(self,online, path ,resize = None,BSHistory = 50, BSThreshold = 15, minBlobAreaRatio = 0.0003, maxBlobAreaRatio = 0.15):
+  def __init__(self,online, path ,resize = None,BSHistory = 50, BSThreshold = 15, minBlobAreaRatio = 0.0003, maxBlobAreaRatio = 0.15,
+               motionGate = False, gateThreshold = 2.0, gateSize = 32, tracker = None, thumbnails = True):
     self.online = online
     self.backgroundMOG = cv2.createBackgroundSubtractorMOG2(history = BSHistory, varThreshold = BSThreshold, detectShadows = False)
+    self.history = BSHistory
+    self.modelFrames = 0
+    self.motionGate = motionGate
+    self.gateThreshold = gateThreshold
+    self.gateSize = gateSize
+    self.gateRef = None
+    self.skippedFrames = 0
+    self.staticImg = None
+    self.processedFrames = 0
+    self.gatedFrames = 0
+    self.tracker = tracker
+    self.trackIds = []
+    self.changedTracks = []
     self.minBlobRatio = minBlobAreaRatio
     self.maxBlobRatio = maxBlobAreaRatio
     self.bb = []
+    self.patchBuffer = None
     readImg = None;
     self.img = None;
 
@@ -71,11 +114,19 @@ class Webcam:
       frame_filenames = os.listdir(path)
       self.frame_paths = [os.path.join(path, fn) for fn in sorted(frame_filenames)]
       self.imgIdx = 0
+      self.thumbnailDir = None
+      if thumbnails and resize:
+        camera = os.path.basename(os.path.normpath(path))
+        thumbnailDir = thumbnails_directory(os.path.dirname(os.path.normpath(path)))
+        level = pick_level(thumbnailDir, camera, max(resize))
+        if level is not None:
+          self.thumbnailDir = os.path.join(thumbnailDir, str(level), camera)
 
-      readImg = cv2.imread(self.frame_paths[self.imgIdx], cv2.IMREAD_COLOR)
+      readImg = self._readFrame(self.imgIdx)
 
     self.contours = [];
     self.contourArea = 0.0;
+    self.contourArcLength = 0.0;
 
     if resize:
       self.size = resize
@@ -93,6 +144,8 @@ class Webcam:
       self.img = cv2.resize(readImg,(self.size[1],self.size[0]))
       #blurimg = cv2.GaussianBlur(self.img,(5,5),0)
       self.foremask = self.backgroundMOG.apply(self.img)
+      self.modelFrames = 1
+      self.gateRef = self._gateThumbnail()
 
   def update(self):
     readImg = None
@@ -113,39 +166,98 @@ class Webcam:
         pass
     else:
       if self.imgIdx < len(self.frame_paths):
-        readImg = cv2.imread(self.frame_paths[self.imgIdx],cv2.IMREAD_COLOR)
+        readImg = self._readFrame(self.imgIdx)
         self.imgIdx = self.imgIdx+1
 
+    self.feed(readImg)
+
+  def _readFrame(self, idx):
+    if self.thumbnailDir is not None:
+      readImg = cv2.imread(os.path.join(self.thumbnailDir, os.path.basename(self.frame_paths[idx])), cv2.IMREAD_COLOR)
+      if readImg is not None:
+        return readImg
+    return cv2.imread(self.frame_paths[idx], cv2.IMREAD_COLOR)
+
+  def feed(self, readImg):
     self.hasImg = False
     if readImg is not None:
       self.hasImg = True
       self.img = cv2.resize(readImg,(self.size[1],self.size[0]))
       self.overlaid = np.copy(self.img)
-      #blurimg = cv2.GaussianBlur(self.img,(5,5),0)
-      self.foremask = self.backgroundMOG.apply(self.img)
-      self.foremask = cv2.morphologyEx(self.foremask,cv2.MORPH_CLOSE,np.ones((2,2),np.uint8))
-
-      contourCpy = np.copy(self.foremask)
-      self.contours = cv2.findContours(contourCpy,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)[1]
-      self.contourArea = 0.0;
-      self.contourArcLength = 0.0;
-
-      if self.contours:
-        filteredContours = [];
-        for contour in self.contours:
-          cA = cv2.contourArea(contour)
-
-          if cA > self.minBlobRatio*self.numPixels and cA < self.maxBlobRatio*self.numPixels:
-            self.contourArea = self.contourArea + cA
-            self.contourArcLength = self.contourArcLength + cv2.arcLength(contour,True)
-            filteredContours.append(contour)
 
-        self.contours = sorted(filteredContours, key = cv2.contourArea, reverse = True)
-        self.bb = [cv2.boundingRect(cntr) for cntr in self.contours]
+      if self.motionGate:
+        thumbnail = self._gateThumbnail()
+        if self.gateRef is not None and cv2.absdiff(thumbnail, self.gateRef).mean() < self.gateThreshold:
+          self.gatedFrames += 1
+          self.skippedFrames += 1
+          self.staticImg = self.img
+          self._drawOverlay()
+          self._track()
+          return
+        self.gateRef = thumbnail
+
+      self._detect()
+
+  def _detect(self):
+    self.processedFrames += 1
+    #blurimg = cv2.GaussianBlur(self.img,(5,5),0)
+    if self.skippedFrames > 0:
+      self.backgroundMOG.apply(self.staticImg, learningRate = self._learningRate(self.skippedFrames))
+      self.modelFrames += self.skippedFrames
+      self.skippedFrames = 0
+      self.staticImg = None
+    self.foremask = self.backgroundMOG.apply(self.img, learningRate = self._learningRate(1))
+    self.modelFrames += 1
+    self.foremask = cv2.morphologyEx(self.foremask,cv2.MORPH_CLOSE,np.ones((2,2),np.uint8))
+
+    contourCpy = np.copy(self.foremask)
+    self.contours = cv2.findContours(contourCpy,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)[1]
+    self.contourArea = 0.0;
+    self.contourArcLength = 0.0;
+    self.bb = []
 
-        cv2.drawContours(self.overlaid,self.contours,-1,(0,255,0), thickness = 1)
-        for rect in self.bb:
-          cv2.rectangle(self.overlaid,(rect[0],rect[1]),(rect[0]+rect[2],rect[1]+rect[3]),(0,0,255),thickness = 1)
+    if self.contours:
+      filteredContours = [];
+      for contour in self.contours:
+        cA = cv2.contourArea(contour)
+
+        if cA > self.minBlobRatio*self.numPixels and cA < self.maxBlobRatio*self.numPixels:
+          self.contourArea = self.contourArea + cA
+          self.contourArcLength = self.contourArcLength + cv2.arcLength(contour,True)
+          filteredContours.append(contour)
+
+      self.contours = sorted(filteredContours, key = cv2.contourArea, reverse = True)
+      self.bb = [cv2.boundingRect(cntr) for cntr in self.contours]
+
+      self._drawOverlay()
+
+    self._track()
+
+  def _track(self):
+    if self.tracker is not None:
+      self.trackIds, self.changedTracks = self.tracker.update(self.bb)
+
+  def _drawOverlay(self):
+    cv2.drawContours(self.overlaid,self.contours,-1,(0,255,0), thickness = 1)
+    for rect in self.bb:
+      cv2.rectangle(self.overlaid,(rect[0],rect[1]),(rect[0]+rect[2],rect[1]+rect[3]),(0,0,255),thickness = 1)
+
+  # Learning rate that makes one background update stand in for `frames` consecutive updates of a static scene.
+  # MOG2's automatic rate after n frames is 1/min(2n, history), and a static scene applied k times keeps a weight of
+  # prod(1 - rate) on the old model, so this compounds the rates the skipped frames would have used.
+  def _learningRate(self, frames):
+    keep = 1.0
+    n = self.modelFrames
+    while frames > 0 and 2*(n + 1) < self.history:
+      n += 1
+      frames -= 1
+      keep *= 1.0 - 1.0/(2*n)
+    keep *= (1.0 - 1.0/self.history)**frames
+    return 1.0 - keep
+
+  def _gateThumbnail(self):
+    gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (self.gateSize, self.gateSize), interpolation = cv2.INTER_AREA)
 
   def filtered_overlay(self, classifier, squareSize=227):
     red = (0, 0, 255)
@@ -158,22 +270,27 @@ class Webcam:
     overlay = np.copy(self.img)
     cv2.drawContours(overlay, self.contours, -1, green, thickness = 1)
 
-    for i, patch in enumerate(self.patches(squareSize=squareSize)):
-      rect = self.bb[i]
+    batch = self.patchBatch(squareSize)
+    if len(batch) == 0:
+      return overlay
+
+    if self.tracker is not None:
+      toClassify = [i for i in range(len(batch)) if self.changedTracks[i]]
+      for i, probabilities in zip(toClassify, classifier.forward_batch(batch[toClassify])):
+        self.tracker.markClassified(self.trackIds[i], probabilities)
+        self.changedTracks[i] = False
+      probabilities = np.array([self.tracker.result(trackId) for trackId in self.trackIds[:len(batch)]])
+    else:
+      probabilities = classifier.forward_batch(batch)
+
+    decisions = decide(probabilities, classifier.label_index(), 1.0 - 0.03)
+    for rect, decision in zip(self.bb, decisions):
       a = (rect[0], rect[1])
       b = (rect[0] + rect[2], rect[1] + rect[3])
-      rankings = classifier.rankings(patch)
-      labels = set(('human', 'noise', 'animal', 'vehicle'))
-      probs  = {}
-      for label, idx, prob in rankings:
-        if label in labels:
-          probs[label] = prob
-
-      if probs['noise'] < 1.0 - 0.03:
-        if probs['human'] > probs['vehicle']:
-          cv2.rectangle(overlay, a, b, blue, thickness = 1)
-        else:
-          cv2.rectangle(overlay, a, b, red, thickness = 1)
+      if decision == 'human':
+        cv2.rectangle(overlay, a, b, blue, thickness = 1)
+      elif decision == 'vehicle':
+        cv2.rectangle(overlay, a, b, red, thickness = 1)
 
     return overlay
 
@@ -205,5 +322,66 @@ class Webcam:
 
     return bbPatches
 
-
-
+  def snapshot(self):
+    lastFrame = ''
+    if not self.online and self.imgIdx > 0:
+      lastFrame = os.path.basename(self.frame_paths[self.imgIdx - 1])
+
+    return {'background': self.background(),
+            'history': self.history,
+            'varThreshold': self.backgroundMOG.getVarThreshold(),
+            'modelFrames': self.modelFrames,
+            'lastFrame': lastFrame}
+
+  def restore(self, snapshot):
+    background = snapshot['background']
+    if background.shape[0:2] != tuple(self.size):
+      background = cv2.resize(background,(self.size[1],self.size[0]))
+
+    # A learning rate of 1 makes MOG2 discard its model and start over from a single mode per pixel at the background
+    # value. Later updates then run at the rate of a model that has seen modelFrames frames (see _learningRate).
+    self.history = int(snapshot['history'])
+    self.backgroundMOG = cv2.createBackgroundSubtractorMOG2(history = self.history, varThreshold = float(snapshot['varThreshold']), detectShadows = False)
+    self.backgroundMOG.apply(background, learningRate = 1)
+    self.modelFrames = int(snapshot['modelFrames'])
+    self.skippedFrames = 0
+    self.staticImg = None
+
+    lastFrame = str(snapshot['lastFrame'])
+    if not self.online and lastFrame:
+      names = [os.path.basename(p) for p in self.frame_paths]
+      self.imgIdx = bisect.bisect_right(names, lastFrame)
+
+  def patchBatch(self, squareSize, num = float('Inf'), out = None, padSquare = False, context = 0.0):
+    num = len(self.bb) if num == 0 else int(min(num, len(self.bb)))
+
+    if out is None:
+      if self.patchBuffer is None or self.patchBuffer.shape[0] < num or self.patchBuffer.shape[1] != squareSize:
+        self.patchBuffer = np.empty((num, squareSize, squareSize, 3), dtype = np.uint8)
+      out = self.patchBuffer
+
+    batch = out[:num]
+    for i, rect in enumerate(self.bb[:num]):
+      cv2.resize(self._crop(rect, padSquare, context), (squareSize, squareSize), dst = batch[i])
+
+    return batch
+
+  def _crop(self, rect, padSquare = False, context = 0.0):
+    x, y, w, h = rect
+    if not padSquare and context == 0:
+      return self.img[y:y+h, x:x+w]
+
+    if padSquare:
+      side = max(w, h)
+      x, y, w, h = x - (side - w)//2, y - (side - h)//2, side, side
+    if context > 0:
+      marginX, marginY = int(round(context*w)), int(round(context*h))
+      x, y, w, h = x - marginX, y - marginY, w + 2*marginX, h + 2*marginY
+
+    imgH, imgW = self.img.shape[0:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, imgW), min(y + h, imgH)
+    crop = self.img[y0:y1, x0:x1]
+    if (x0, y0, x1, y1) != (x, y, x + w, y + h):
+      crop = cv2.copyMakeBorder(crop, y0 - y, y + h - y1, x0 - x, x + w - x1, cv2.BORDER_CONSTANT, value = (0, 0, 0))
+    return crop
@@ -0,0 +1,217 @@
+import numpy as np
+import os
+
+# Approximate nearest-neighbor search over webcam histograms (see
+# features.bovw), to ask which webcams look like a given one.
+#
+# Histograms are compared with the Hellinger distance, i.e. the Euclidean
+# distance between their element-wise square roots, which suits L1-normalized
+# histograms better than the Euclidean distance between them.
+
+def hellinger_embedding(histograms):
+  histograms = np.asarray(histograms, dtype=np.float32)
+  return np.sqrt(np.maximum(histograms, 0))
+
+# Returns the (N x M) squared Euclidean distances between the rows of `a` and
+# the rows of `b`, given the squared norms of the rows of `b`.
+def squared_distances(a, b, b_norms):
+  distances = np.dot(a, b.T)
+  distances *= -2
+  distances += b_norms
+  distances += (a * a).sum(axis=1)[:, None]
+  return np.maximum(distances, 0, out=distances)
+
+# Returns the index of the nearest row of `centroids` for every row of
+# `vectors`, `block_size` rows at a time.
+def nearest_centroids(vectors, centroids, block_size=4096):
+  norms = (centroids * centroids).sum(axis=1)
+  nearest = np.empty(len(vectors), dtype=np.int64)
+  for start in range(0, len(vectors), block_size):
+    block = vectors[start:start + block_size]
+    nearest[start:start + block_size] = (np.dot(block, centroids.T) * -2 +
+        norms).argmin(axis=1)
+  return nearest
+
+# Lloyd's k-means with k-means++ seeding. Returns the (k x D) centroids.
+def kmeans(vectors, k, iterations=20, seed=0):
+  rng = np.random.RandomState(seed)
+  k = min(k, len(vectors))
+  centroids = np.empty((k, vectors.shape[1]), dtype=np.float32)
+  centroids[0] = vectors[rng.randint(len(vectors))]
+  closest = squared_distances(vectors, centroids[:1],
+      (centroids[:1] * centroids[:1]).sum(axis=1))[:, 0]
+  for i in range(1, k):
+    total = closest.sum()
+    if total <= 0:
+      centroids[i] = vectors[rng.randint(len(vectors))]
+    else:
+      centroids[i] = vectors[rng.choice(len(vectors), p=closest / total)]
+    closest = np.minimum(closest, squared_distances(vectors, centroids[i:i + 1],
+        (centroids[i:i + 1] * centroids[i:i + 1]).sum(axis=1))[:, 0])
+
+  for _ in range(iterations):
+    assignments = nearest_centroids(vectors, centroids)
+    counts = np.bincount(assignments, minlength=k)
+    sums = np.zeros_like(centroids)
+    np.add.at(sums, assignments, vectors)
+    moved = counts > 0
+    updated = sums[moved] / counts[moved][:, None]
+    if np.allclose(updated, centroids[moved]):
+      break
+    centroids[moved] = updated
+  return centroids
+
+# Returns the (k x 2) indices and squared distances of the k nearest rows of
+# `vectors` to `query`, nearest first. `norms` are the squared norms of the
+# rows of `vectors`.
+def top_k(query, vectors, norms, k):
+  distances = squared_distances(query[None, :], vectors, norms)[0]
+  k = min(k, len(distances))
+  if k == 0:
+    return np.zeros(0, np.int64), np.zeros(0, np.float32)
+  nearest = np.argpartition(distances, k - 1)[:k]
+  nearest = nearest[np.argsort(distances[nearest], kind='mergesort')]
+  return nearest, distances[nearest]
+
+# Inverted-file (IVF) index of named histograms.
+#
+# The embedded histograms are partitioned among `num_lists` k-means centroids.
+# A query ranks only the members of its `nprobe` nearest lists, so it touches
+# about nprobe / num_lists of the index; nprobe = num_lists is exact.
+#
+# Histograms can be added at any time: they join the list of their nearest
+# centroid, and adding a name again replaces its histogram. Centroids are not
+# updated by additions; call train() again once the catalog has changed
+# substantially.
+class IVFIndex(object):
+  def __init__(self, num_lists=128, nprobe=8):
+    self.num_lists_ = num_lists
+    self.nprobe_ = nprobe
+    self.centroids_ = None
+    self.centroid_norms_ = None
+    self.names_ = []
+    self.rows_ = {}
+    self.vectors_ = np.zeros((0, 0), np.float32)
+    self.norms_ = np.zeros(0, np.float32)
+    self.assignments_ = np.zeros(0, np.int64)
+    self.size_ = 0
+    self.members_ = None
+
+  def __len__(self):
+    return self.size_
+
+  def __contains__(self, name):
+    return name in self.rows_
+
+  def names(self):
+    return list(self.names_)
+
+  # Computes the centroids from `histograms` (by default, the histograms in
+  # the index) and reassigns every histogram in the index.
+  def train(self, histograms=None, iterations=20, seed=0):
+    if histograms is None:
+      vectors = self.vectors_[:self.size_]
+    else:
+      vectors = hellinger_embedding(histograms)
+    if len(vectors) == 0:
+      raise ValueError('No histograms to train the index on.')
+    num_lists = max(1, min(self.num_lists_, len(vectors)))
+    self.centroids_ = kmeans(vectors, num_lists, iterations, seed)
+    self.centroid_norms_ = (self.centroids_ * self.centroids_).sum(axis=1)
+    if self.size_:
+      self.assignments_[:self.size_] = nearest_centroids(
+          self.vectors_[:self.size_], self.centroids_)
+    self.members_ = None
+
+  # Adds or replaces the histograms of `names`. The index must be trained.
+  def add(self, names, histograms):
+    if self.centroids_ is None:
+      raise ValueError('The index must be trained before adding histograms.')
+    if not len(names):
+      return
+    vectors = hellinger_embedding(histograms).reshape(len(names), -1)
+    rows = []
+    for name in names:
+      if name not in self.rows_:
+        self.rows_[name] = len(self.names_)
+        self.names_.append(name)
+      rows.append(self.rows_[name])
+    rows = np.array(rows, dtype=np.int64)
+
+    size = len(self.names_)
+    if size > len(self.vectors_):
+      capacity = max(size, 2 * len(self.vectors_), 1024)
+      grown = np.zeros((capacity, vectors.shape[1]), np.float32)
+      if self.size_:
+        grown[:self.size_] = self.vectors_[:self.size_]
+      self.vectors_ = grown
+      self.norms_ = np.resize(self.norms_, capacity)
+      self.assignments_ = np.resize(self.assignments_, capacity)
+    self.vectors_[rows] = vectors
+    self.norms_[rows] = (vectors * vectors).sum(axis=1)
+    self.assignments_[rows] = nearest_centroids(vectors, self.centroids_)
+    self.size_ = size
+    self.members_ = None
+
+  # Groups the rows of the index by list, rebuilt after changes: returns
+  # (rows, bounds), where rows[bounds[i]:bounds[i + 1]] are the rows of list i.
+  # The vectors and norms of the rows are copied in the same order, so a list
+  # is scanned contiguously.
+  def members(self):
+    if self.members_ is None:
+      assignments = self.assignments_[:self.size_]
+      rows = np.argsort(assignments, kind='mergesort')
+      bounds = np.searchsorted(assignments[rows], np.arange(len(self.centroids_) + 1))
+      self.members_ = (rows, bounds, self.vectors_[rows], self.norms_[rows])
+    return self.members_[:2]
+
+  # Returns [(name, distance)] of the k histograms nearest to `histogram`,
+  # nearest first, searching the `nprobe` (default: the index's) nearest
+  # lists. Distances are Hellinger distances.
+  def query(self, histogram, k=10, nprobe=None):
+    if not self.size_:
+      return []
+    nprobe = min(nprobe or self.nprobe_, len(self.centroids_))
+    query = hellinger_embedding(histogram).ravel()
+    lists, _ = top_k(query, self.centroids_, self.centroid_norms_, nprobe)
+    rows, bounds = self.members()
+    vectors, norms = self.members_[2:]
+    slices = [slice(bounds[i], bounds[i + 1]) for i in lists]
+    distances = np.concatenate([norms[s] - 2 * np.dot(vectors[s], query)
+        for s in slices]) + np.dot(query, query)
+    candidates = np.concatenate([rows[s] for s in slices])
+    k = min(k, len(candidates))
+    if k == 0:
+      return []
+    nearest = np.argpartition(distances, k - 1)[:k]
+    nearest = nearest[np.argsort(distances[nearest], kind='mergesort')]
+    return [(self.names_[candidates[i]], float(np.sqrt(max(distances[i], 0))))
+        for i in nearest]
+
+  # Same as query, for a name in the index; the name itself is left out.
+  def similar(self, name, k=10, nprobe=None):
+    histogram = np.square(self.vectors_[self.rows_[name]])
+    return [(other, d) for other, d in self.query(histogram, k + 1, nprobe)
+        if other != name][:k]
+
+  def save(self, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, centroids=self.centroids_, names=np.array(self.names_),
+          vectors=self.vectors_[:self.size_],
+          assignments=self.assignments_[:self.size_],
+          num_lists=self.num_lists_, nprobe=self.nprobe_)
+    os.rename(tmp_path, path)
+
+def load_index(path):
+  with np.load(path) as data:
+    index = IVFIndex(int(data['num_lists']), int(data['nprobe']))
+    index.centroids_ = data['centroids']
+    index.centroid_norms_ = (index.centroids_ * index.centroids_).sum(axis=1)
+    index.names_ = [str(name) for name in data['names']]
+    index.rows_ = dict((name, i) for i, name in enumerate(index.names_))
+    index.vectors_ = data['vectors']
+    index.norms_ = (index.vectors_ * index.vectors_).sum(axis=1)
+    index.assignments_ = data['assignments'].astype(np.int64)
+    index.size_ = len(index.names_)
+  return index
@@ -0,0 +1,188 @@
+import cv2
+import numpy as np
+import os
+
+# Bag-of-visual-words features of frames, the Python counterpart of the
+# descriptor / feature steps of cluster/src/complete.cc. Frames are described
+# by dense SIFT and every descriptor is assigned to its nearest word of a
+# vocabulary stored by the C++ pipeline (cluster/src/cache.cc).
+
+# Loads the (num_words x 128) float32 vocabulary matrix from an OpenCV YAML
+# file, e.g. analysis/vocabulary/vocabulary.yml or vocabulary.yml.bak.
+def load_vocabulary(path, node='vocabulary'):
+  storage = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+  try:
+    vocabulary = storage.getNode(node).mat()
+  finally:
+    storage.release()
+  if vocabulary is None:
+    raise ValueError('%s has no %s matrix.' % (path, node))
+  return np.ascontiguousarray(vocabulary, dtype=np.float32)
+
+# Writes a matrix the way cluster/src/cache.cc stores it, so the C++ clustering
+# step can read features computed here: <directory>/<leaf>.yml with a node
+# named after the leaf.
+def store_mat(directory, leaf, mat):
+  storage = cv2.FileStorage(os.path.join(directory, leaf + '.yml'),
+      cv2.FILE_STORAGE_WRITE)
+  try:
+    storage.write(leaf, mat)
+  finally:
+    storage.release()
+
+def create_sift():
+  if hasattr(cv2, 'SIFT_create'):
+    return cv2.SIFT_create()
+  return cv2.xfeatures2d.SIFT_create()
+
+# Returns, for each row of `descriptors`, the index of the nearest row of
+# `vocabulary` (Euclidean). Uses |d - v|^2 = |d|^2 - 2 d.v + |v|^2, where |d|^2
+# does not change the argmin, so each block of descriptors costs one matrix
+# product. Blocks of `block_size` rows bound the (block_size x num_words)
+# distance matrix.
+def nearest_words(descriptors, vocabulary, block_size=4096,
+    vocabulary_norms=None):
+  if vocabulary_norms is None:
+    vocabulary_norms = (vocabulary * vocabulary).sum(axis=1)
+  words = np.empty(len(descriptors), dtype=np.int64)
+  for start in range(0, len(descriptors), block_size):
+    block = descriptors[start:start + block_size]
+    distances = np.dot(block, vocabulary.T)
+    distances *= -2
+    distances += vocabulary_norms
+    words[start:start + block_size] = distances.argmin(axis=1)
+  return words
+
+# Scales each row of `counts` to sum to 1; rows without any counts stay 0.
+def l1_normalize(counts):
+  counts = np.asarray(counts, dtype=np.float32)
+  totals = counts.sum(axis=-1, keepdims=True)
+  return counts / np.maximum(totals, 1e-12)
+
+# The parameters of cluster/src/complete.cc: OpenCV 2.4's Dense detector with
+# its defaults (a keypoint of diameter 1 every 6 pixels, from the border of the
+# full-size grayscale frame), at most 100 descriptors from each of 10 frames
+# per webcam, and raw word counts. complete.cc keeps the 100 keypoints with
+# the highest response, but Dense keypoints all have response 0, so these are
+# the first ones of the grid, row by row (see BowEncoder's spread argument).
+CLUSTER_ENCODER_ARGS = dict(step=6, size=1, max_side=0, max_descriptors=100,
+    spread=False)
+CLUSTER_FRAMES_PER_WEBCAM = 10
+
+# Encodes frames as word histograms over a vocabulary.
+#
+# Descriptors are computed on a grid of keypoints every `step` pixels, of
+# diameter `size`, after shrinking frames so that their larger side is at
+# most `max_side` (0 keeps frames as they are). At most `max_descriptors` grid
+# points are used per frame (0 for all): evenly spread over the grid, or the
+# first ones in row order if `spread` is False.
+class BowEncoder(object):
+  def __init__(self, vocabulary, step=8, size=16, max_side=256,
+      max_descriptors=0, spread=True, block_size=4096):
+    self.vocabulary_ = vocabulary
+    self.vocabulary_norms_ = (vocabulary * vocabulary).sum(axis=1)
+    self.step_ = step
+    self.size_ = size
+    self.max_side_ = max_side
+    self.max_descriptors_ = max_descriptors
+    self.spread_ = spread
+    self.block_size_ = block_size
+    self.sift_ = create_sift()
+    self.grids_ = {}
+
+  def num_words(self):
+    return len(self.vocabulary_)
+
+  def grid(self, shape):
+    if shape not in self.grids_:
+      half = self.size_ // 2
+      end = 1 if half else 0
+      ys, xs = np.mgrid[half:shape[0] - half + end:self.step_,
+          half:shape[1] - half + end:self.step_]
+      points = np.stack([xs.ravel(), ys.ravel()], axis=1)
+      if self.max_descriptors_ and len(points) > self.max_descriptors_:
+        if self.spread_:
+          keep = np.linspace(0, len(points) - 1, self.max_descriptors_)
+          points = points[keep.astype(np.int64)]
+        else:
+          points = points[:self.max_descriptors_]
+      self.grids_[shape] = [cv2.KeyPoint(float(x), float(y), self.size_)
+          for x, y in points]
+    return self.grids_[shape]
+
+  # Returns the (N x 128) float32 descriptors of a BGR or grayscale frame.
+  def describe(self, image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = float(self.max_side_) / max(gray.shape)
+    if self.max_side_ and scale < 1:
+      gray = cv2.resize(gray, (int(round(gray.shape[1] * scale)),
+          int(round(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+    _, descriptors = self.sift_.compute(gray, self.grid(gray.shape))
+    if descriptors is None:
+      return np.zeros((0, 128), np.float32)
+    return descriptors
+
+  # Returns a (len(images) x num_words) matrix of word counts. The descriptors
+  # of all images are assigned to words together.
+  def count_batch(self, images):
+    descriptors = [self.describe(image) for image in images]
+    owners = np.repeat(np.arange(len(images)), [len(d) for d in descriptors])
+    words = nearest_words(np.concatenate(descriptors) if descriptors else
+        np.zeros((0, 128), np.float32), self.vocabulary_, self.block_size_,
+        self.vocabulary_norms_)
+    num_words = self.num_words()
+    counts = np.bincount(owners * num_words + words,
+        minlength=len(images) * num_words)
+    return counts.reshape(len(images), num_words)
+
+  # Returns the L1-normalized word histograms of `images`.
+  def encode_batch(self, images):
+    return l1_normalize(self.count_batch(images))
+
+  def encode(self, image):
+    return self.encode_batch([image])[0]
+
+# Per-process state of encode_webcam workers.
+worker_encoder = None
+worker_cluster_encoder = None
+
+def init_worker(vocabulary, encoder_args):
+  global worker_encoder, worker_cluster_encoder
+  cv2.setNumThreads(1)
+  worker_encoder = BowEncoder(vocabulary, **encoder_args)
+  worker_cluster_encoder = BowEncoder(vocabulary, **CLUSTER_ENCODER_ARGS)
+
+def read_frames(paths):
+  images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+  return [(os.path.basename(path), image) for path, image in zip(paths, images)
+      if image is not None]
+
+# Encodes the frames of one webcam, `batch_size` frames at a time. Returns
+# (camera, names, frame_histograms, webcam_histogram, cluster_counts): the names
+# of the frames that could be read, their L1-normalized histograms and the
+# L1-normalized histogram of all their descriptors pooled. `cluster_paths` are
+# frames sampled as complete.cc does (see CLUSTER_FRAMES_PER_WEBCAM);
+# cluster_counts is the (num_words x 1) int32 column of their raw word counts
+# with CLUSTER_ENCODER_ARGS, or None without cluster_paths or if fewer of them
+# could be read, where complete.cc skips the webcam.
+def encode_webcam(task):
+  camera, paths, batch_size, cluster_paths = task
+  names = []
+  counts = []
+  for start in range(0, len(paths), batch_size):
+    batch = read_frames(paths[start:start + batch_size])
+    if not batch:
+      continue
+    names.extend(name for name, _ in batch)
+    counts.append(worker_encoder.count_batch([image for _, image in batch]))
+  num_words = worker_encoder.num_words()
+  counts = np.concatenate(counts) if counts else np.zeros((0, num_words), np.int64)
+
+  cluster_counts = None
+  cluster_frames = read_frames(cluster_paths)
+  if cluster_frames and len(cluster_frames) == len(cluster_paths):
+    cluster_counts = worker_cluster_encoder.count_batch(
+        [image for _, image in cluster_frames]).sum(axis=0)
+    cluster_counts = cluster_counts.astype(np.int32).reshape(-1, 1)
+  return (camera, names, l1_normalize(counts), l1_normalize(counts.sum(axis=0)),
+      cluster_counts)
@@ -0,0 +1,65 @@
+#### Script to run detection behind the frame scraper #####
+# Example usage - follow_frames.py webcam/frames -c cursors.json -s snapshots
+# 1st arg : Directory containing webcam image folders, as written by scrape_frames.py
+# -c (optional) : JSON file holding the last processed frame of every webcam. Default follow_cursors.json
+# -s (optional) : Directory of background-model snapshots, saved every --snapshot-every frames per webcam
+# -w (optional) : File listing the webcam folders to follow, one per line. By default all folders are followed
+# -p (optional) : Side dimension frames are resized to before detection. By default frames are not resized
+# -a (optional) : Process every frame, including frames stored as the same content as the previous frame of their webcam
+#
+# Every frame is read from disk once, so webcams are no longer fetched a second time by detector.Webcam(online = True).
+
+import cv2
+import os
+import argparse
+
+from detector.Webcam import Webcam
+from detector.FrameFollower import FrameFollower
+from detector.SnapshotStore import SnapshotStore
+
+parser = argparse.ArgumentParser()
+parser.add_argument("frames_dir",
+    help = "Directory containing webcam image folders")
+parser.add_argument("-c", "--cursors", default = "follow_cursors.json",
+    help = "JSON file holding the last processed frame of every webcam")
+parser.add_argument("-s", "--snapshots",
+    help = "Directory of background-model snapshots")
+parser.add_argument("--snapshot-every", type = int, default = 20,
+    help = "Number of frames between snapshots of a webcam")
+parser.add_argument("-w", "--webcams",
+    help = "File listing the webcam folders to follow")
+parser.add_argument("-p", "--picSize", type = int,
+    help = "Side dimension frames are resized to")
+parser.add_argument("-a", "--all-frames", action = "store_true",
+    help = "Also process frames identical to the previous frame of their webcam")
+parser.add_argument("--poll", type = float, default = 5,
+    help = "Seconds to wait when no new frames are found")
+args = parser.parse_args()
+
+cameras = None
+if args.webcams:
+  with open(args.webcams) as f:
+    cameras = [line.strip() for line in f if line.strip()]
+
+resize = (args.picSize, args.picSize) if args.picSize else None
+store = SnapshotStore(args.snapshots) if args.snapshots else None
+follower = FrameFollower(args.frames_dir, args.cursors, cameras, skipDuplicates = not args.all_frames)
+cams = {}
+framesSeen = {}
+
+def process(camera, framePath):
+  if camera not in cams:
+    cams[camera] = Webcam(online = False, resize = resize, path = os.path.join(args.frames_dir, camera))
+    if store is not None:
+      store.load(camera, cams[camera])
+    framesSeen[camera] = 0
+
+  cam = cams[camera]
+  cam.feed(cv2.imread(framePath, cv2.IMREAD_COLOR))
+  framesSeen[camera] += 1
+  if cam.hasImg:
+    print "%s %s objects: %d score: %f" % (camera, os.path.basename(framePath), len(cam.bb), cam.score())
+  if store is not None and cam.hasImg and framesSeen[camera] % args.snapshot_every == 0:
+    store.save(camera, cam)
+
+follower.follow(process, pollInterval = args.poll)
@@ -0,0 +1,43 @@
+import argparse
+import os
+
+from dataset.records import LABELS, PatchWriter
+
+# Copies a database/<label>/*.jpg tree of labeled patches into a record
+# directory (see dataset/records.py). The JPEG bytes are copied as they are;
+# camera, timestamp and bounding box are unknown and left empty.
+#
+# Usage Example:
+#   import_patches.py database database/records
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("database", help="Directory with one subdirectory of patches per label")
+  parser.add_argument("records", help="Record directory to append the patches to")
+  args = parser.parse_args()
+  return args
+
+def main(args):
+  writer = PatchWriter(args.records)
+  try:
+    for label in LABELS:
+      label_dir = os.path.join(args.database, label)
+      if not os.path.isdir(label_dir):
+        continue
+      # Numeric file names were assigned in labeling order.
+      names = sorted(os.listdir(label_dir),
+          key=lambda fn: (len(fn), fn))
+      for name in names:
+        if not name.endswith('.jpg'):
+          continue
+        with open(os.path.join(label_dir, name), 'rb') as f:
+          writer.write_encoded(f.read(), label)
+      print "%s: %d patches" % (label, len(names))
+    print "%d patches in %s" % (len(writer), args.records)
+  finally:
+    writer.close()
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
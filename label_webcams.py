@@ -6,14 +6,19 @@ import argparse
 import time
 
 from detector.Webcam import Webcam
+from detector.SnapshotStore import SnapshotStore, warmUp
 from classify.classifier import ReferenceClassifier
 from classify.classifier import CamClassifier
+from classify.cache import perceptual_hash
+from dataset.dedup import BKTree, DEFAULT_RADIUS
 
 parser = argparse.ArgumentParser()
 parser.add_argument("frames_dir",
     help = "Directory containing webcam image folders")
 parser.add_argument("num_webcams",
     help = "Number of webcams to sample", type = int)
+parser.add_argument("-s", "--snapshots",
+    help = "Directory of background-model snapshots used to skip warm-up")
 args = parser.parse_args()
 
 frames_dir = args.frames_dir
@@ -21,6 +26,7 @@ num_webcams = args.num_webcams
 
 wc_paths = [os.path.join(frames_dir, fn) for fn in os.listdir(frames_dir)]
 wc_paths = random.sample(wc_paths, num_webcams)
+store = SnapshotStore(args.snapshots) if args.snapshots else None
 # cams  = [Webcam(online=False, path=p) for p in wc_paths]
 
 def classify_one(classifier, patches):
@@ -36,7 +42,7 @@ def classify_one(classifier, patches):
       return
 
 classifier = CamClassifier()
-classifier.set_batch_size(1)
+classifier.set_batch_size(32)
 
 webcam = Webcam(online = True,
     path = "http://vso.aa0.netvolante.jp/record/current.jpg")
@@ -67,17 +73,23 @@ for i in range(5):
   # map(lambda c: c.update(), cams)
   webcam.update()
 
+# Hashes of the patches shown so far, so near-duplicates are not shown again.
+shown = BKTree()
+
 def find_interesting_object(classifier, wc_paths):
   for i, path in enumerate(wc_paths):
     print i
     cam = Webcam(online=False, path=path)
-    for i in range(10):
-      cam.update()
-    for patch in cam.patches(squareSize=227):
+    warmUp(cam, store, os.path.basename(path), 10)
+    batch = cam.patchBatch(227)
+    for patch, rankings in zip(batch, classifier.rankings_batch(batch)):
       if patch is not None:
-        rankings = classifier.rankings(patch)
         for label, idx, prob in rankings:
           if label == 'human' and prob > 0.015:
+            h = perceptual_hash(patch)
+            if shown.query(h, DEFAULT_RADIUS):
+              continue
+            shown.add(h)
             print rankings
             cv2.imshow('patch', patch)
             cv2.waitKey(0)
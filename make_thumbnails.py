@@ -0,0 +1,63 @@
+#! /bin/python3.5
+
+import argparse
+import glob
+import logging
+import os
+
+import webcam.thumbnails
+
+
+def make_thumbnails(frames_directory, levels, max_bytes):
+  """Writes the thumbnails of already scraped frames.
+
+  Frames that already have a thumbnail at the smallest level are skipped, so
+  the job can be rerun after an interrupted run.
+
+  Args:
+    frames_directory (str): The directory of per-webcam frame directories.
+    levels (list (int)): The short sides of the thumbnails to write.
+    max_bytes (int): The size budget of the thumbnails, or None.
+  """
+  logger = logging.getLogger('make_thumbnails')
+  directory = webcam.thumbnails.thumbnails_directory(frames_directory)
+  thumbnails = webcam.thumbnails.ThumbnailCache(directory, levels, max_bytes)
+  num_frames = 0
+  num_written = 0
+  for path in sorted(glob.glob("%s/*/*.jpg" % frames_directory)):
+    camera = os.path.basename(os.path.dirname(path))
+    frame = os.path.basename(path)
+    if os.path.exists(webcam.thumbnails.thumbnail_path(directory, min(levels),
+        camera, frame)):
+      continue
+    with open(path, 'rb') as f:
+      num_written += thumbnails.write(f.read(), camera, frame)
+    num_frames += 1
+  logger.info("Wrote %d thumbnails of %d frames.", num_written, num_frames)
+
+
+def main():
+  """Writes the thumbnails of already scraped frames.
+
+  Usage Example:
+    make_thumbnails.py --levels 64,128,256 --budget 2048
+  """
+  parser = argparse.ArgumentParser(prog='make_thumbnails')
+  parser.add_argument('-f', '--frames', required=False,
+      default="%s/webcam/frames" % os.path.dirname(os.path.realpath(__file__)),
+      help='The directory of per-webcam frame directories.')
+  parser.add_argument('-l', '--levels', required=False,
+      default=','.join(str(level) for level in webcam.thumbnails.LEVELS),
+      help='Comma separated short sides of the thumbnails to write.')
+  parser.add_argument('-b', '--budget', type=int, required=False,
+      help='The size budget of the thumbnails (in MB).')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  levels = [int(level) for level in args.levels.split(',')]
+  max_bytes = args.budget << 20 if args.budget else None
+  make_thumbnails(args.frames, levels, max_bytes)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,168 @@
+#### Script to mine the frames archive for patches worth labeling #####
+# Example usage - mine_candidates.py webcam/frames candidates.csv --score target --target human -j 8
+# 1st arg : Directory containing webcam image folders
+# 2nd arg : CSV file the ranked candidates are written to (rank, score, camera, frame, x, y, w, h, and one probability per label)
+# --score (optional)   : 'uncertainty' ranks patches by how close the two most probable labels are, 'target' by the probability of --target.
+#                        Default uncertainty
+# -k (optional)        : Number of candidates to keep. Default 1000
+# --per-camera (optional) : Maximum number of candidates from a single webcam, so one flickering scene cannot fill the list. Default 20
+# -j (optional)        : Number of forked worker processes, each mining its share of the webcams. Default 4
+# --patches (optional) : Directory the candidate patches are written to as <rank>.jpg
+#
+# Detection and classification run in batches inside each worker; workers keep their own top-k heaps, which are merged at the end.
+
+import argparse
+import csv
+import cv2
+import heapq
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+from classify.backends import BACKENDS
+from classify.classifier import CamClassifier
+from classify.workers import fork_workers, wait_workers
+from detector.Webcam import Webcam
+
+K_LABELS = ['animal', 'human', 'noise', 'vehicle']
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("frames_dir", help="Directory containing webcam image folders")
+  parser.add_argument("output", help="CSV file the ranked candidates are written to")
+  parser.add_argument("--score", default="uncertainty", choices=["uncertainty", "target"],
+      help="How patches are ranked")
+  parser.add_argument("--target", default="human", choices=K_LABELS,
+      help="Label whose probability ranks patches with --score target")
+  parser.add_argument("-k", "--top-k", type=int, default=1000,
+      help="Number of candidates to keep")
+  parser.add_argument("--per-camera", type=int, default=20,
+      help="Maximum number of candidates from a single webcam")
+  parser.add_argument("-j", "--workers", type=int, default=4,
+      help="Number of worker processes")
+  parser.add_argument("--backend", default="cpu", choices=[b for b in BACKENDS if b != 'gpu'],
+      help="Inference backend")
+  parser.add_argument("--threads", type=int, default=1,
+      help="Number of CPU threads per worker")
+  parser.add_argument("--batch-size", type=int, default=32,
+      help="Maximum number of patches per forward pass")
+  parser.add_argument("--warm-up", type=int, default=10,
+      help="Number of frames of each webcam used only to build its background model")
+  parser.add_argument("--patch-size", type=int, default=227,
+      help="Side of the patches given to the classifier")
+  parser.add_argument("--patches", help="Directory the candidate patches are written to")
+  args = parser.parse_args()
+  return args
+
+# Returns one score per row of `probabilities` (restricted to K_LABELS and
+# renormalized); higher scores are better candidates.
+def score_patches(probabilities, score, target):
+  probabilities = probabilities / np.maximum(probabilities.sum(axis=1), 1e-12)[:, None]
+  if score == 'target':
+    return probabilities[:, K_LABELS.index(target)]
+  top2 = np.partition(probabilities, -2, axis=1)[:, -2:]
+  return 1.0 - (top2[:, 1] - top2[:, 0])
+
+# Mines every frame of one webcam. Returns a list of (score, frame, bb,
+# probabilities) holding its best `limit` patches.
+def mine_camera(classifier, columns, path, args, limit):
+  heap = []
+  if not os.listdir(path):
+    return heap
+  cam = Webcam(online=False, path=path, motionGate=True)
+  for i in range(args.warm_up):
+    cam.update()
+  while cam.imgIdx < len(cam.frame_paths):
+    processed = cam.processedFrames
+    cam.update()
+    # Frames skipped by the motion gate keep the boxes already scored.
+    if not cam.hasImg or cam.processedFrames == processed or not cam.bb:
+      continue
+    frame = os.path.splitext(os.path.basename(cam.frame_paths[cam.imgIdx - 1]))[0]
+    batch = cam.patchBatch(args.patch_size)
+    probabilities = classifier.forward_batch(batch)[:, columns]
+    scores = score_patches(probabilities, args.score, args.target)
+    for score, bb, row in zip(scores, cam.bb, probabilities):
+      item = (float(score), frame, [int(v) for v in bb], [float(p) for p in row])
+      if len(heap) < limit:
+        heapq.heappush(heap, item)
+      elif item > heap[0]:
+        heapq.heappushpop(heap, item)
+  return heap
+
+def mine(classifier, worker, wc_paths, args, results_dir):
+  label_index = classifier.label_index()
+  columns = [label_index[label] for label in K_LABELS]
+  heap = []
+  started = time.time()
+  paths = wc_paths[worker::args.workers]
+  for i, path in enumerate(paths):
+    camera = os.path.basename(path)
+    # A broken webcam (e.g. whose first frame does not decode) must not cost
+    # the other webcams of the worker.
+    try:
+      mined = mine_camera(classifier, columns, path, args,
+          min(args.per_camera, args.top_k))
+    except Exception as e:
+      print "worker %d: skipping %s: %r" % (worker, camera, e)
+      continue
+    for score, frame, bb, row in mined:
+      item = (score, camera, frame, bb, row)
+      if len(heap) < args.top_k:
+        heapq.heappush(heap, item)
+      elif item > heap[0]:
+        heapq.heappushpop(heap, item)
+    print "worker %d: %d/%d webcams, %f s" % (worker, i + 1, len(paths), time.time() - started)
+  with open(os.path.join(results_dir, '%d.json' % worker), 'w') as f:
+    json.dump(heap, f)
+
+def write_patches(candidates, frames_dir, directory, patch_size):
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  for rank, (score, camera, frame, bb, row) in enumerate(candidates):
+    img = cv2.imread(os.path.join(frames_dir, camera, frame + '.jpg'), cv2.IMREAD_COLOR)
+    if img is None:
+      continue
+    x, y, w, h = bb
+    patch = cv2.resize(img[y:y+h, x:x+w], (patch_size, patch_size))
+    cv2.imwrite(os.path.join(directory, '%d.jpg' % rank), patch)
+
+def main(args):
+  wc_paths = sorted(os.path.join(args.frames_dir, fn) for fn in os.listdir(args.frames_dir))
+  classifier = CamClassifier(backend=args.backend, threads=args.threads)
+  classifier.set_batch_size(args.batch_size)
+
+  results_dir = tempfile.mkdtemp()
+  try:
+    started = time.time()
+    pids = fork_workers(classifier, args.workers, mine, (wc_paths, args, results_dir))
+    if not wait_workers(pids):
+      print "A mining worker failed; its webcams are missing from the candidates."
+    candidates = []
+    for worker in range(args.workers):
+      path = os.path.join(results_dir, '%d.json' % worker)
+      if not os.path.exists(path):
+        continue
+      with open(path) as f:
+        candidates.extend(tuple(item) for item in json.load(f))
+  finally:
+    shutil.rmtree(results_dir)
+  candidates = heapq.nlargest(args.top_k, candidates)
+
+  with open(args.output, 'wb') as f:
+    writer = csv.writer(f)
+    writer.writerow(['rank', 'score', 'camera', 'frame', 'x', 'y', 'w', 'h'] + K_LABELS)
+    for rank, (score, camera, frame, bb, row) in enumerate(candidates):
+      writer.writerow([rank, score, camera, frame] + list(bb) + list(row))
+  if args.patches:
+    write_patches(candidates, args.frames_dir, args.patches, args.patch_size)
+  print "%d candidates from %d webcams in %f s" % (len(candidates), len(wc_paths),
+      time.time() - started)
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
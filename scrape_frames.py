@@ -1,6 +1,7 @@
 #! /bin/python3.5
 
 import webcam.metadata.manager
+import webcam.thumbnails
 import webcam.webcam
 
 import argparse
@@ -98,7 +99,8 @@ def dispatcher_thread_fn(webcams, webcam_queue, period, duration):
       logger.error("Taking too long to dispatch scrape requests.")
 
 
-def scrape_frames(source, identifiers, period, duration, num_scrapers):
+def scrape_frames(source, identifiers, period, duration, num_scrapers,
+    thumbnails=None):
   """Scrapes frames in parallel.
 
   Args:
@@ -108,6 +110,8 @@ def scrape_frames(source, identifiers, period, duration, num_scrapers):
     period (datetime.timedelta): The period  between frames.
     duration (datetime.timedelta): The duration to scrape for.
     num_scrapers (int): The number of scraper threads.
+    thumbnails (webcam.thumbnails.ThumbnailCache, default None): The cache
+        downscaled copies of the frames are written to, if any.
   """
   # Setup the manager.
   manager = webcam.metadata.manager.Manager()
@@ -115,7 +119,7 @@ def scrape_frames(source, identifiers, period, duration, num_scrapers):
   # Populate a list of live webcams to scrape.
   webcams = []
   for identifier in identifiers:
-    cam = webcam.webcam.Webcam(manager.get(identifier, source))
+    cam = webcam.webcam.Webcam(manager.get(identifier, source), thumbnails)
     if cam.is_live():
       webcams.append(cam)
 
@@ -158,6 +162,11 @@ def main():
       default=["7"], help='The duration to scrape for (in Days).')
   parser.add_argument('-t', '--threads', nargs=1, required=False,
       default=["100"], help='The number of scraping threads.')
+  parser.add_argument('-p', '--thumbnails', nargs=1, required=False,
+      help='Comma separated short sides of the thumbnails to write, e.g. '
+          '64,128,256.')
+  parser.add_argument('-b', '--thumbnail-budget', nargs=1, required=False,
+      help='The size budget of the thumbnails (in MB).')
   args = parser.parse_args()
 
   # Parse command-line arguments.
@@ -168,6 +177,14 @@ def main():
   period = datetime.timedelta(minutes=int(args.period[0]))
   duration = datetime.timedelta(days=int(args.duration[0]))
   num_threads = int(args.threads[0])
+  thumbnails = None
+  if args.thumbnails:
+    levels = [int(level) for level in args.thumbnails[0].split(',')]
+    max_bytes = None
+    if args.thumbnail_budget:
+      max_bytes = int(args.thumbnail_budget[0]) << 20
+    thumbnails = webcam.thumbnails.ThumbnailCache("%s/thumbnails" %
+        webcam.webcam.data_directory(), levels, max_bytes)
 
   # Set up logging.
   logging.basicConfig(filename='scrape_frames.log', filemode='a',
@@ -175,7 +192,8 @@ def main():
           datefmt='%H:%M:%S', level=logging.INFO)
 
   # Scrape frames.
-  scrape_frames(source, identifiers, period, duration, num_threads)
+  scrape_frames(source, identifiers, period, duration, num_threads,
+      thumbnails)
 
 
 if __name__ == "__main__":
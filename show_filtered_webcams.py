@@ -6,14 +6,20 @@ import argparse
 import time
 
 from detector.Webcam import Webcam
+from detector.SnapshotStore import SnapshotStore, warmUp
 from classify.classifier import ReferenceClassifier
 from classify.classifier import CamClassifier
+from classify.server import ClassificationClient
 
 parser = argparse.ArgumentParser()
 parser.add_argument("frames_dir",
     help = "Directory containing webcam image folders")
 parser.add_argument("num_webcams",
     help = "Number of webcams to sample", type = int)
+parser.add_argument("-s", "--snapshots",
+    help = "Directory of background-model snapshots used to skip warm-up")
+parser.add_argument("-c", "--classification-server",
+    help = "Socket of a running classification_server.py to use instead of loading the net")
 args = parser.parse_args()
 
 frames_dir = args.frames_dir
@@ -21,16 +27,19 @@ num_webcams = args.num_webcams
 
 wc_paths = [os.path.join(frames_dir, fn) for fn in os.listdir(frames_dir)]
 wc_paths = random.sample(wc_paths, num_webcams)
+store = SnapshotStore(args.snapshots) if args.snapshots else None
 
 
-classifier = CamClassifier()
-classifier.set_batch_size(1)
+if args.classification_server:
+  classifier = ClassificationClient(args.classification_server)
+else:
+  classifier = CamClassifier()
+  classifier.set_batch_size(32)
 
 while True:
   for path in wc_paths:
     cam = Webcam(online=False, path=path)
-    for i in range(5):
-      cam.update()
+    warmUp(cam, store, os.path.basename(path), 5)
     overlay = cam.filtered_overlay(classifier, squareSize=227)
     if overlay is not None:
       cv2.imshow('overlay', overlay)
@@ -4,6 +4,9 @@
 # 2nd arg : Number of webcams to process (samples randomly among all webcam folders in Dir)
 # 3rd arg -p (optional) : Side dimension of square images that are displayed. Default 200
 # 4th arg -d (optional) : Number of webcam images to display. Default 5
+# --headless (optional) : Directory the display is written to (as display.jpg, replaced every frame) instead of being shown in a window
+# --keep (optional)     : With --headless, keeps the last N displays as display_<n>.jpg, n cycling through 0..N-1, instead of one display.jpg
+# --rate (optional)     : Displays rendered per second. Default 10
 
 import numpy as np
 import cv2
@@ -11,6 +14,7 @@ import os
 import sys
 import random
 import argparse
+import time
 
 from detector.Webcam import Webcam
 
@@ -19,6 +23,9 @@ parser.add_argument("Dir",help = "Directory containing webcam image folders")
 parser.add_argument("numWebcamsToSample",help = "Number of webcams to sample", type = int)
 parser.add_argument("-p","--picSize",help = "Side dimension of square images to be displayed",type = int, default = 200)
 parser.add_argument("-d","--numDisplays", help = "Number of top webcam images to display", type = int, default = 5)
+parser.add_argument("--headless",help = "Directory to write displays to instead of showing them")
+parser.add_argument("--keep",help = "Number of headless displays kept (0 keeps only display.jpg)", type = int, default = 0)
+parser.add_argument("--rate",help = "Displays rendered per second", type = float, default = 10)
 args = parser.parse_args()
 
 Dir = args.Dir
@@ -33,21 +40,44 @@ webcamList = [webcamList[i] for i in sampleIdx]
 
 webcams = map(lambda x : Webcam(online = False,resize = (picSize,picSize),path = x),webcamList)
 
-while True:
-  map(lambda x: x.update(),webcams)
-
-  webcams.sort(key = lambda x: x.score(), reverse = True)
+# Top row holds the overlaid images of the top webcams, bottom row their backgrounds.
+# Tiles are written into the canvas in place, so no mosaic is copied per frame.
+display = np.zeros((2*picSize, numDisplays*picSize, 3), dtype = np.uint8)
+scores = np.zeros(len(webcams))
+if args.headless and not os.path.isdir(args.headless):
+  os.makedirs(args.headless)
 
-  overlays = webcams[0].overlaidImage()
-  for i in range(1,numDisplays):
-    overlays = np.hstack((overlays,webcams[i].overlaidImage()))
-
-  backgrounds = webcams[0].background()
-  for i in range(1,numDisplays):
-    backgrounds = np.hstack((backgrounds,webcams[i].background()))
+frameNo = 0
+reportFrames = 0
+reportStart = time.time()
+period = 1.0/args.rate
+while True:
+  started = time.time()
+  for i, webcam in enumerate(webcams):
+    webcam.update()
+    scores[i] = webcam.score()
 
-  display = np.vstack((overlays,backgrounds))
+  # Only the top numDisplays are sorted.
+  top = np.argpartition(-scores, numDisplays - 1)[:numDisplays]
+  top = top[np.argsort(-scores[top], kind = 'mergesort')]
 
-  cv2.imshow("Display", display)
+  for i, idx in enumerate(top):
+    display[:picSize, i*picSize:(i+1)*picSize] = webcams[idx].overlaidImage()
+    display[picSize:, i*picSize:(i+1)*picSize] = webcams[idx].background()
 
-  cv2.waitKey(100)
+  frameNo += 1
+  reportFrames += 1
+  if args.headless:
+    name = "display_%d.jpg" % (frameNo % args.keep) if args.keep > 0 else "display.jpg"
+    # Written under a temporary name and renamed, so viewers never see a partial image.
+    tmpPath = os.path.join(args.headless, "tmp_" + name)
+    cv2.imwrite(tmpPath, display)
+    os.rename(tmpPath, os.path.join(args.headless, name))
+    if time.time() - reportStart >= 10:
+      print "%f displays/s" % (reportFrames/(time.time() - reportStart))
+      reportFrames = 0
+      reportStart = time.time()
+    time.sleep(max(0, period - (time.time() - started)))
+  else:
+    cv2.imshow("Display", display)
+    cv2.waitKey(max(1, int(1000*(period - (time.time() - started)))))
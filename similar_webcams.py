@@ -0,0 +1,66 @@
+import argparse
+import numpy as np
+import os
+import time
+
+from features.ann import IVFIndex, load_index
+
+# Finds the webcams that look most like given webcams, using an IVF index
+# (see features/ann.py) over the webcam histograms of compute_features.py.
+#
+# The index file is created on first use and trained on all histograms.
+# Later runs only add webcams that are not in it yet (and replace all of them
+# with --update), so new cameras become searchable without retraining;
+# --retrain recomputes the centroids.
+#
+# Usage Example:
+#   similar_webcams.py features_out/webcams.npz webcams.ivf.npz opentopia_00011008 -k 10
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("webcams", help="webcams.npz written by compute_features.py")
+  parser.add_argument("index", help="Index file, created if it does not exist")
+  parser.add_argument("cameras", nargs="*", help="Webcams to find similar webcams for")
+  parser.add_argument("-k", type=int, default=10, help="Number of similar webcams")
+  parser.add_argument("--lists", type=int, default=128,
+      help="Number of inverted lists of a new index")
+  parser.add_argument("--nprobe", type=int, help="Number of lists searched")
+  parser.add_argument("--update", action="store_true",
+      help="Replace the histograms of webcams already in the index")
+  parser.add_argument("--retrain", action="store_true",
+      help="Recompute the centroids from the histograms in the index")
+  args = parser.parse_args()
+  return args
+
+def main(args):
+  with np.load(args.webcams) as data:
+    cameras = [str(camera) for camera in data['cameras']]
+    histograms = data['histograms']
+
+  if os.path.exists(args.index):
+    index = load_index(args.index)
+  else:
+    index = IVFIndex(args.lists)
+    index.train(histograms)
+  new = [i for i, camera in enumerate(cameras) if args.update or camera not in index]
+  index.add([cameras[i] for i in new], histograms[new])
+  if args.retrain:
+    index.train()
+  if new or args.retrain or not os.path.exists(args.index):
+    index.save(args.index)
+  print("%d webcams indexed (%d added or updated)" % (len(index), len(new)))
+
+  for camera in args.cameras:
+    if camera not in index:
+      print("%s is not indexed" % camera)
+      continue
+    started = time.time()
+    similar = index.similar(camera, args.k, args.nprobe)
+    print("%s (%f ms):" % (camera, 1000 * (time.time() - started)))
+    for other, distance in similar:
+      print("\t%s %f" % (other, distance))
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
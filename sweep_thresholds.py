@@ -0,0 +1,89 @@
+import argparse
+import numpy as np
+import time
+
+import classification_metrics
+from classification_metrics import K_LABELS
+from classify.rules import sweep
+
+# Evaluates the noise-threshold / human-ratio decision rule (see
+# classify.rules.decide) over a grid of parameters, using probabilities from a
+# ProbabilityStore. Patches missing from the store are classified once and
+# added to it, so later sweeps run without inference.
+#
+# Usage Example:
+#   sweep_thresholds.py patches.txt --store probabilities --output pr.csv
+
+def retrieve_arguments():
+  parser = argparse.ArgumentParser()
+  classification_metrics.add_arguments(parser)
+  parser.add_argument("--noise-thresholds", nargs=3, type=float,
+      default=[0.005, 1.0, 200], metavar=("MIN", "MAX", "NUM"),
+      help="Linearly spaced noise thresholds to try")
+  parser.add_argument("--human-ratios", nargs=3, type=float,
+      default=[0.01, 100.0, 81], metavar=("MIN", "MAX", "NUM"),
+      help="Logarithmically spaced human/vehicle ratios to try")
+  parser.add_argument("--output", help="CSV file to write every configuration to")
+  args = parser.parse_args()
+  if not args.store:
+    parser.error("--store is required")
+  return args
+
+def f1(precision, recall):
+  return 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+
+def main(args):
+  classifier = classification_metrics.create_classifier(args)
+  paths, labels, read = classification_metrics.read_labeled_patches(args.dataset)
+  indices, probabilities, num_inferred, _ = classification_metrics.classify_patches(
+      classifier, paths, args, classification_metrics.open_store(classifier, args),
+      read)
+  truth = np.array(K_LABELS)[labels[np.array(indices, dtype=np.int64)]]
+  print "%d patches, %d newly classified" % (len(indices), num_inferred)
+
+  thresholds = np.linspace(args.noise_thresholds[0], args.noise_thresholds[1],
+      int(args.noise_thresholds[2]))
+  ratios = np.logspace(np.log10(args.human_ratios[0]),
+      np.log10(args.human_ratios[1]), int(args.human_ratios[2]))
+
+  start = time.time()
+  counts = sweep(probabilities, truth, classifier.label_index(), thresholds,
+      ratios)
+  elapsed = time.time() - start
+  print "%d configurations in %f s" % (thresholds.size * ratios.size, elapsed)
+
+  precision = {}
+  recall = {}
+  for label, (correct, classified, labeled) in counts.items():
+    precision[label] = correct / np.maximum(1, classified).astype(float)
+    recall[label] = correct / np.maximum(1, labeled).astype(float)
+  scores = {
+      'human F1': f1(precision['human'], recall['human']),
+      'vehicle F1': f1(precision['vehicle'], recall['vehicle']),
+      'mean F1': sum(f1(precision[l], recall[l]) for l in precision) / len(precision),
+  }
+
+  for name in sorted(scores):
+    t, r = np.unravel_index(scores[name].argmax(), scores[name].shape)
+    print "best %s: %f at noise < %f, human > %f * vehicle" % (name,
+        scores[name][t, r], thresholds[t], ratios[r])
+    for label in sorted(precision):
+      print "\t%s precision: %f recall: %f" % (label, precision[label][t, r],
+          recall[label][t, r])
+
+  if args.output:
+    labels = sorted(precision)
+    with open(args.output, 'w') as f:
+      f.write(','.join(['noise_threshold', 'human_ratio'] +
+          ['%s_%s' % (label, m) for label in labels for m in ('precision', 'recall')]) + '\n')
+      for t, threshold in enumerate(thresholds):
+        for r, ratio in enumerate(ratios):
+          values = [threshold, ratio]
+          for label in labels:
+            values += [precision[label][t, r], recall[label][t, r]]
+          f.write(','.join('%g' % v for v in values) + '\n')
+
+
+if __name__ == "__main__":
+  args = retrieve_arguments()
+  main(args)
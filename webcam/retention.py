@@ -0,0 +1,408 @@
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import os
+import time
+
+import webcam.webcam
+
+FRAME_FORMAT = '%Y_%m_%d_%H_%M_%S'
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_duration(text):
+  """Parses a duration such as '90s', '15m', '48h', '7d' or '2w'.
+
+  Args:
+    text (str): The duration. 'inf' and 'all' mean no limit.
+
+  Returns:
+    float: The duration in seconds, or None for no limit.
+  """
+  if text in ('inf', 'all'):
+    return None
+  return float(text[:-1]) * _UNITS[text[-1]]
+
+
+def parse_tiers(text):
+  """Parses a comma separated list of retention tiers.
+
+  Every tier is written <max age>:<spacing>. A tier holds the frames younger
+  than its max age and older than the previous tier's. Its frames are thinned
+  to (the first) one per spacing, or all kept if the spacing is 'all'. Frames
+  older than the last max age are deleted; a last max age of 'inf' keeps them.
+
+  Args:
+    text (str): The tiers, e.g. '48h:all,30d:1h,inf:1d'.
+
+  Returns:
+    list ((float, float)): The (max age, spacing) of every tier, in seconds,
+        with None for no limit and for keeping every frame.
+  """
+  tiers = []
+  for tier in text.split(','):
+    max_age, spacing = tier.split(':')
+    tiers.append((parse_duration(max_age), parse_duration(spacing)))
+  for (age, _), (next_age, _) in zip(tiers, tiers[1:]):
+    if age is None or (next_age is not None and next_age <= age):
+      raise ValueError('Tier ages must increase: %s' % text)
+  return tiers
+
+
+def frame_time(name):
+  """The time a frame was fetched at.
+
+  Args:
+    name (str): The frame file name, e.g. 2016_05_01_12_00_00.jpg.
+
+  Returns:
+    float: The local time of the frame, in seconds since the epoch.
+  """
+  return time.mktime(time.strptime(name[:-4], FRAME_FORMAT))
+
+
+def frame_name(seconds):
+  """The frame file name for a time; inverse of frame_time.
+
+  Args:
+    seconds (float): A local time in seconds since the epoch.
+
+  Returns:
+    str: The name of a frame fetched at that second.
+  """
+  return time.strftime(FRAME_FORMAT, time.localtime(seconds)) + '.jpg'
+
+
+class Retention(object):
+  """Thins and bounds the frames archive.
+
+  Frames are kept according to tiers (see parse_tiers), and, when max_bytes
+  is given, the oldest frames of all webcams are deleted until the archive
+  fits in it. The size of the archive counts every distinct file once, so
+  frames sharing an object (see webcam.webcam.object_path) are counted once
+  and only free space when the last of them is deleted. Deleting a frame also
+  deletes its thumbnails and, if no other frame links to it, its object.
+
+  Compaction is incremental. The sizes of frames are remembered between
+  passes, so a pass only stats new frames. The time every webcam was last
+  compacted is saved in state_path, and a pass only revisits the frames that
+  moved to another tier since then.
+
+  It is safe to run next to the scraper: frames, objects and thumbnails
+  younger than grace are never deleted, and the scraper only adds new files.
+
+  Usage Example:
+    retention = Retention('webcam/frames', parse_tiers('48h:all,30d:1h,inf:1d'),
+        max_bytes=200 << 30, state_path='retention.json')
+    while True:
+      retention.compact()
+      time.sleep(600)
+  """
+  def __init__(self, frames_directory, tiers, max_bytes=None, grace=600,
+      state_path=None):
+    """Initializes a Retention.
+
+    Args:
+      frames_directory (str): The directory of per-webcam frame directories.
+      tiers (list ((float, float))): The tiers, as returned by parse_tiers.
+      max_bytes (int, default None): The size budget of the frames. Unbounded
+          if None.
+      grace (float, default 600): The age, in seconds, below which no file is
+          deleted.
+      state_path (str, default None): The JSON file the compaction times are
+          saved to. Every pass revisits all frames if None.
+    """
+    self._frames_directory = frames_directory
+    self._root = os.path.dirname(os.path.abspath(frames_directory))
+    self._tiers = tiers
+    self._max_bytes = max_bytes
+    self._grace = grace
+    self._state_path = state_path
+    self._logger = logging.getLogger('webcam.retention.Retention')
+    self._compacted = {}
+    if state_path and os.path.exists(state_path):
+      with open(state_path) as f:
+        self._compacted = json.load(f)
+    # camera -> sorted frame names, and camera -> {name: file id}.
+    self._names = {}
+    self._files = {}
+    # file id (st_dev, st_ino) -> [size, number of frames linking to it].
+    self._inodes = {}
+    self._bytes = 0
+    self._levels = []
+    self._swept = False
+
+
+  def size(self):
+    """The size of the distinct frame files seen by the last pass.
+
+    Returns:
+      int: The size in bytes.
+    """
+    return self._bytes
+
+
+  def _scan(self, camera):
+    """Lists a webcam's frames, statting only the ones not seen before.
+
+    Args:
+      camera (str): The name of the webcam's frame directory.
+    """
+    directory = os.path.join(self._frames_directory, camera)
+    try:
+      names = sorted(fn for fn in os.listdir(directory) if fn.endswith('.jpg'))
+    except OSError:
+      names = []
+    files = self._files.setdefault(camera, {})
+    present = set(names)
+    for name in [name for name in files if name not in present]:
+      self._forget(files.pop(name))
+    for name in names:
+      if name in files:
+        continue
+      try:
+        st = os.stat(os.path.join(directory, name))
+      except OSError:
+        present.discard(name)
+        continue
+      file_id = (st.st_dev, st.st_ino)
+      files[name] = file_id
+      inode = self._inodes.setdefault(file_id, [st.st_size, 0])
+      if inode[1] == 0:
+        self._bytes += inode[0]
+      inode[1] += 1
+    self._names[camera] = [name for name in names if name in present]
+
+
+  def _forget(self, file_id):
+    """Drops one reference to a file.
+
+    Args:
+      file_id ((int, int)): The (st_dev, st_ino) of the file.
+
+    Returns:
+      bool: True if no frame refers to the file any more.
+    """
+    inode = self._inodes[file_id]
+    inode[1] -= 1
+    if inode[1] > 0:
+      return False
+    self._bytes -= inode[0]
+    del self._inodes[file_id]
+    return True
+
+
+  def _delete(self, camera, name):
+    """Deletes a frame, its thumbnails and, if orphaned, its object.
+
+    Args:
+      camera (str): The name of the webcam's frame directory.
+      name (str): The name of the frame file.
+    """
+    path = os.path.join(self._frames_directory, camera, name)
+    object_path = None
+    try:
+      # A frame linked only to its object leaves the object orphaned.
+      if os.stat(path).st_nlink == 2:
+        with open(path, 'rb') as f:
+          object_path = webcam.webcam.object_path(
+              hashlib.sha1(f.read()).hexdigest())
+      os.remove(path)
+    except OSError as error:
+      self._logger.error(error)
+    self._forget(self._files[camera].pop(name))
+
+    if object_path is not None:
+      self._remove_orphan(object_path, time.time())
+    thumbnails = os.path.join(self._root, 'thumbnails')
+    for level in self._levels:
+      try:
+        os.remove(os.path.join(thumbnails, level, camera, name))
+      except OSError:
+        pass
+
+
+  def _remove_orphan(self, object_path, now):
+    """Deletes an object no frame links to, unless it is recent.
+
+    Args:
+      object_path (str): The path of the object.
+      now (float): The current time.
+
+    Returns:
+      bool: True if the object was deleted.
+    """
+    try:
+      st = os.stat(object_path)
+      if st.st_nlink == 1 and now - st.st_mtime > self._grace:
+        os.remove(object_path)
+        return True
+    except OSError:
+      pass
+    return False
+
+
+  def _sweep_orphans(self, now):
+    """Deletes every object no frame links to, and thumbnails without frames.
+
+    Returns:
+      int: The number of files deleted.
+    """
+    deleted = 0
+    objects = os.path.join(self._root, 'objects')
+    for root, _, filenames in os.walk(objects):
+      for filename in filenames:
+        deleted += self._remove_orphan(os.path.join(root, filename), now)
+    thumbnails = os.path.join(self._root, 'thumbnails')
+    for level in self._levels:
+      for camera in os.listdir(os.path.join(thumbnails, level)):
+        names = set(self._names.get(camera, ()))
+        directory = os.path.join(thumbnails, level, camera)
+        for name in os.listdir(directory):
+          if name in names:
+            continue
+          try:
+            path = os.path.join(directory, name)
+            if now - os.stat(path).st_mtime > self._grace:
+              os.remove(path)
+              deleted += 1
+          except OSError:
+            pass
+    return deleted
+
+
+  def _windows(self, since, now):
+    """The time ranges whose frames may have changed tier since a pass.
+
+    Args:
+      since (float): The time of the last pass, or None.
+      now (float): The time of this pass.
+
+    Returns:
+      list ((float, float)): [start, end) ranges of frame times. Ranges are
+          widened to whole spacings of the tier frames move to, so every
+          thinned spacing is seen in full.
+    """
+    if since is None:
+      return [(float('-inf'), float('inf'))]
+    windows = []
+    for i, (max_age, _) in enumerate(self._tiers):
+      if max_age is None:
+        break
+      if i + 1 == len(self._tiers):
+        windows.append((float('-inf'), now - max_age + 1))
+        break
+      start, end = since - max_age, now - max_age + 1
+      spacing = self._tiers[i + 1][1]
+      if spacing:
+        start = (start // spacing) * spacing
+        end = (end // spacing + 1) * spacing
+      windows.append((start, end))
+    return windows
+
+
+  def _thin(self, camera, since, now):
+    """Deletes the frames of a webcam its tiers do not keep.
+
+    Args:
+      camera (str): The name of the webcam's frame directory.
+      since (float): The time the webcam was last compacted, or None.
+      now (float): The current time.
+
+    Returns:
+      int: The number of frames deleted.
+    """
+    names = self._names[camera]
+    doomed = set()
+    for start, end in self._windows(since, now):
+      lo = 0 if start == float('-inf') else bisect.bisect_left(names,
+          frame_name(start))
+      hi = len(names) if end == float('inf') else bisect.bisect_left(names,
+          frame_name(end))
+      previous = None
+      for name in names[lo:hi]:
+        t = frame_time(name)
+        age = now - t
+        if age < self._grace:
+          break
+        tier = next((i for i, (max_age, _) in enumerate(self._tiers)
+            if max_age is None or age < max_age), None)
+        if tier is None:
+          doomed.add(name)
+          continue
+        spacing = self._tiers[tier][1]
+        if spacing is None:
+          previous = None
+          continue
+        key = (tier, t // spacing)
+        if key == previous:
+          doomed.add(name)
+        previous = key
+    for name in doomed:
+      self._delete(camera, name)
+    if doomed:
+      self._names[camera] = [name for name in names if name not in doomed]
+    return len(doomed)
+
+
+  def _evict(self, now):
+    """Deletes the oldest frames of all webcams until under the budget.
+
+    Returns:
+      int: The number of frames deleted.
+    """
+    oldest = heapq.merge(*[[(name, camera) for name in names]
+        for camera, names in self._names.items()])
+    newest = frame_name(now - self._grace)
+    doomed = {}
+    for name, camera in oldest:
+      if self._bytes <= self._max_bytes or name >= newest:
+        break
+      self._delete(camera, name)
+      doomed.setdefault(camera, set()).add(name)
+    for camera, names in doomed.items():
+      self._names[camera] = [name for name in self._names[camera]
+          if name not in names]
+    return sum(len(names) for names in doomed.values())
+
+
+  def compact(self, now=None):
+    """Runs one compaction pass.
+
+    Args:
+      now (float, default None): The current time. Defaults to time.time().
+
+    Returns:
+      dict: The number of frames 'thinned' and 'evicted', of 'orphans'
+          deleted, and the size in 'bytes' of the frames left.
+    """
+    now = time.time() if now is None else now
+    thumbnails = os.path.join(self._root, 'thumbnails')
+    self._levels = os.listdir(thumbnails) if os.path.isdir(thumbnails) else []
+    stats = {'thinned': 0, 'evicted': 0, 'orphans': 0}
+
+    for camera in sorted(os.listdir(self._frames_directory)):
+      self._scan(camera)
+      stats['thinned'] += self._thin(camera, self._compacted.get(camera), now)
+      self._compacted[camera] = now
+    if self._max_bytes is not None and self._bytes > self._max_bytes:
+      stats['evicted'] = self._evict(now)
+    # Orphans left by other tools (or by a crash) are swept once per process;
+    # afterwards deleting a frame deletes its object.
+    if not self._swept:
+      stats['orphans'] = self._sweep_orphans(now)
+      self._swept = True
+
+    if self._state_path:
+      tmp_path = self._state_path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(self._compacted, f)
+      os.replace(tmp_path, self._state_path)
+    stats['bytes'] = self._bytes
+    self._logger.info('Thinned %d, evicted %d frames and %d orphans; %d MB '
+        'left.' % (stats['thinned'], stats['evicted'], stats['orphans'],
+            self._bytes >> 20))
+    return stats
@@ -0,0 +1,224 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+# Short sides, in pixels, of the downscaled copies kept of every frame.
+LEVELS = (64, 128, 256)
+
+
+def thumbnails_directory(frames_directory):
+  """The thumbnail directory that goes with a frame directory.
+
+  Args:
+    frames_directory (str): A directory of per-webcam frame directories, e.g.
+        webcam/frames.
+
+  Returns:
+    string: The directory of per-level thumbnail directories, e.g.
+        webcam/thumbnails.
+  """
+  return os.path.join(os.path.dirname(os.path.abspath(frames_directory)),
+      'thumbnails')
+
+
+def thumbnail_path(directory, level, camera, frame):
+  """The path of one thumbnail.
+
+  Args:
+    directory (str): The thumbnail directory.
+    level (int): The short side of the thumbnail.
+    camera (str): The name of the webcam's frame directory.
+    frame (str): The name of the frame file.
+
+  Returns:
+    string: directory/level/camera/frame.
+  """
+  return os.path.join(directory, str(level), camera, frame)
+
+
+def pick_level(directory, camera, size):
+  """The smallest thumbnail level that can stand in for a full frame.
+
+  Args:
+    directory (str): The thumbnail directory.
+    camera (str): The name of the webcam's frame directory.
+    size (int): The largest side the frame will be resized to.
+
+  Returns:
+    int: The smallest level with thumbnails of the webcam whose short side is
+        at least size, or None if there is none.
+  """
+  try:
+    levels = sorted(int(level) for level in os.listdir(directory)
+        if level.isdigit())
+  except OSError:
+    return None
+  for level in levels:
+    if level >= size and os.path.isdir(os.path.join(directory, str(level),
+        camera)):
+      return level
+  return None
+
+
+class ThumbnailCache(object):
+  """Writes a pyramid of downscaled copies of every ingested frame.
+
+  Each level holds the frame resized so that its short side equals the level,
+  keeping its aspect ratio. Levels at least as large as the frame are not
+  written; readers fall back to the full frame for them. The cache is bounded
+  by max_bytes: once exceeded, the least recently written thumbnails are
+  deleted until it is back under 90% of the budget.
+
+  Usage Example:
+    thumbnails = ThumbnailCache('webcam/thumbnails', max_bytes=1 << 30)
+    thumbnails.write(jpeg_bytes, 'opentopia_00011008', '2016_05_01_12_00_00.jpg')
+  """
+  def __init__(self, directory, levels=LEVELS, max_bytes=None, quality=90):
+    """Initializes a ThumbnailCache.
+
+    Args:
+      directory (str): The thumbnail directory. Created if needed.
+      levels (tuple (int), default LEVELS): The short sides to write.
+      max_bytes (int, default None): The size budget of the cache. Unbounded
+          if None.
+      quality (int, default 90): The JPEG quality of the thumbnails.
+    """
+    self._directory = directory
+    self._levels = sorted(levels, reverse=True)
+    self._max_bytes = max_bytes
+    self._quality = quality
+    self._lock = threading.Lock()
+    self._logger = logging.getLogger('webcam.thumbnails.ThumbnailCache')
+    # With a budget, every thumbnail is indexed by path as (mtime, size), and
+    # a heap of (mtime, path, size) orders them for eviction. Heap entries
+    # that no longer match the index (overwritten or deleted thumbnails) are
+    # skipped when popped.
+    self._entries = {}
+    self._heap = []
+    self._bytes = 0
+    if max_bytes is not None:
+      files, self._bytes = self._scan()
+      self._entries = dict((path, (mtime, size)) for mtime, path, size in files)
+      self._heap = files
+      heapq.heapify(self._heap)
+
+
+  def _scan(self):
+    """Lists the thumbnails.
+
+    Returns:
+      (list ((float, str, int)), int): The (mtime, path, size) of every
+          thumbnail and their total size.
+    """
+    files = []
+    for root, _, filenames in os.walk(self._directory):
+      for filename in filenames:
+        path = os.path.join(root, filename)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        files.append((st.st_mtime, path, st.st_size))
+    return files, sum(size for _, _, size in files)
+
+
+  def write(self, data, camera, frame):
+    """Writes the thumbnails of one frame.
+
+    Args:
+      data (bytes): The encoded frame.
+      camera (str): The name of the webcam's frame directory.
+      frame (str): The name of the frame file.
+
+    Returns:
+      int: The number of thumbnails written.
+    """
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+      self._logger.error('Could not decode %s/%s.' % (camera, frame))
+      return 0
+
+    written = 0
+    # Shrink level by level, so each level is resized from the previous one.
+    for level in self._levels:
+      height, width = image.shape[:2]
+      if level >= min(height, width):
+        continue
+      scale = float(level) / min(height, width)
+      image = cv2.resize(image, (max(1, int(round(width * scale))),
+          max(1, int(round(height * scale)))), interpolation=cv2.INTER_AREA)
+      ok, encoded = cv2.imencode('.jpg', image,
+          [int(cv2.IMWRITE_JPEG_QUALITY), self._quality])
+      if not ok:
+        continue
+      path = thumbnail_path(self._directory, level, camera, frame)
+      if not os.path.isdir(os.path.dirname(path)):
+        try:
+          os.makedirs(os.path.dirname(path))
+        except OSError:
+          pass
+      tmppath = "%s.%d.tmp" % (path, threading.current_thread().ident)
+      with open(tmppath, 'wb') as f:
+        f.write(encoded.tobytes())
+      os.rename(tmppath, path)
+      written += 1
+      self._added(path, len(encoded))
+    return written
+
+
+  def _added(self, path, num_bytes):
+    """Indexes a new thumbnail and evicts if over budget.
+
+    Args:
+      path (str): The path of the new thumbnail.
+      num_bytes (int): The size of the new thumbnail.
+    """
+    if self._max_bytes is None:
+      return
+    with self._lock:
+      mtime = time.time()
+      previous = self._entries.get(path)
+      if previous is not None:
+        self._bytes -= previous[1]
+      self._entries[path] = (mtime, num_bytes)
+      heapq.heappush(self._heap, (mtime, path, num_bytes))
+      self._bytes += num_bytes
+      if self._bytes > self._max_bytes:
+        self.evict(int(0.9 * self._max_bytes))
+      if len(self._heap) > 2 * len(self._entries) + 1024:
+        self._heap = [(mtime, path, size)
+            for path, (mtime, size) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+
+  def evict(self, target_bytes):
+    """Deletes the oldest thumbnails until the cache fits in target_bytes.
+
+    Called with the lock held. Thumbnails that were already deleted by
+    someone else are dropped from the index without counting as deleted.
+
+    Args:
+      target_bytes (int): The size to shrink the cache to.
+
+    Returns:
+      int: The number of thumbnails deleted.
+    """
+    deleted = 0
+    while self._heap and self._bytes > target_bytes:
+      mtime, path, size = heapq.heappop(self._heap)
+      if self._entries.get(path) != (mtime, size):
+        continue
+      del self._entries[path]
+      self._bytes -= size
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      deleted += 1
+    self._logger.info('Evicted %d thumbnails.' % deleted)
+    return deleted
@@ -1,13 +1,87 @@
 import datetime
 import glob
+import hashlib
 import logging
 import os
+import shutil
 import socket
+import threading
 import urllib
 import urllib.error
 import urllib.request
 
 
+_placeholders = None
+_placeholders_lock = threading.Lock()
+
+
+def data_directory():
+  """The directory holding frames, objects and the placeholder list.
+
+  Returns:
+    string: The directory of this module.
+  """
+  return os.path.dirname(os.path.realpath(__file__))
+
+
+def object_path(digest):
+  """The path at which frame bytes with a given SHA-1 are stored.
+
+  Every distinct frame is stored once under webcam/objects/, in a
+  subdirectory named after the first two hex digits of its digest. Frame
+  directories hold hard links to these objects.
+
+  Args:
+    digest (str): The hex SHA-1 digest of the frame bytes.
+
+  Returns:
+    string: The path of the object.
+  """
+  return "%s/objects/%s/%s.jpg" % (data_directory(), digest[:2], digest)
+
+
+def placeholders():
+  """The digests of known placeholder frames.
+
+  Placeholders (e.g. "camera offline" images) are listed as hex SHA-1 digests,
+  one per line, in webcam/placeholders.txt. Lines starting with '#' are
+  comments. The list is read once per process.
+
+  Returns:
+    set (str): The digests of frames that are never stored.
+  """
+  global _placeholders
+  with _placeholders_lock:
+    if _placeholders is None:
+      _placeholders = set()
+      path = "%s/placeholders.txt" % data_directory()
+      if os.path.exists(path):
+        with open(path) as f:
+          _placeholders = set(line.split()[0] for line in f
+              if line.strip() and not line.startswith('#'))
+    return _placeholders
+
+
+def link_frame(source, destination, tmppath):
+  """Atomically makes destination refer to the same bytes as source.
+
+  destination becomes a hard link to source, or, on file systems without hard
+  links, a copy of it. Either way it is created at tmppath first and renamed,
+  so it appears complete.
+
+  Args:
+    source (str): The existing file.
+    destination (str): The path to create or replace.
+    tmppath (str): A path on the same file system as destination that no other
+        writer uses.
+  """
+  try:
+    os.link(source, tmppath)
+  except OSError:
+    shutil.copyfile(source, tmppath)
+  os.replace(tmppath, destination)
+
+
 class Webcam(object):
   """Manages webcams.
 
@@ -25,14 +99,17 @@ class Webcam(object):
     for frame in webcam.frames():
       use(frame)
   """
-  def __init__(self, metadata):
+  def __init__(self, metadata, thumbnails=None):
     """Initializes a Webcam object.
 
     Args:
       metadata (metadata.scraper.Metadata): The metadata which uniquely
           identifies the webcam.
+      thumbnails (thumbnails.ThumbnailCache, default None): When given,
+          fetched frames are also written to it as downscaled copies.
     """
     self._metadata = metadata
+    self._thumbnails = thumbnails
     self._logger = logging.getLogger('webcam.webcam.Webcam')
 
 
@@ -42,15 +119,31 @@ class Webcam(object):
     Returns:
       string: The directory in which frames are stored.
     """
-    return "%s/frames/%s_%08d/" % (os.path.dirname(os.path.realpath(__file__)),
+    return "%s/frames/%s_%08d/" % (data_directory(),
         self._metadata.source, int(self._metadata.identifier))
 
 
+  def _tmp_directory(self):
+    """The directory in which frames are written before being moved in place.
+
+    It lives on the same file system as the frames, so moving a frame into
+    self._frame_directory() is atomic and readers never see partial frames.
+
+    Returns:
+      string: The directory in which partially written frames are stored.
+    """
+    return "%s/tmp/" % data_directory()
+
+
   def fetch_current_frame(self, timeout=10):
     """Fetches the current frame from the webcam.
 
-    Constructs and sends an HTTP request to the webcam. Saves the response to
-    self._frame_directory().
+    Constructs and sends an HTTP request to the webcam. The response is stored
+    once by content, at object_path(), and linked into
+    self._frame_directory() under the current timestamp. Cameras serving the
+    same JPEG for hours thus cost one copy of it. Known placeholders (see
+    placeholders()) are dropped. Files are written to self._tmp_directory()
+    first and then renamed, so they appear complete.
 
     Args:
       timeout (int, default 10): The maximum time to block on a connection.
@@ -76,12 +169,36 @@ class Webcam(object):
     filename = "%04d_%02d_%02d_%02d_%02d_%02d" % (now.year, now.month, now.day,
         now.hour, now.minute, now.second)
     filepath = "%s%s.jpg" % (self._frame_directory(), filename)
+    tmppath = "%s%s_%08d_%s.jpg" % (self._tmp_directory(),
+        self._metadata.source, int(self._metadata.identifier), filename)
     try:
-      os.makedirs(os.path.dirname(filepath), exist_ok=True)
-      with open(filepath, 'wb') as f:
-        self._logger.info('Succesfully saved frame for %s from %s.' %
+      data = response.read()
+      digest = hashlib.sha1(data).hexdigest()
+      if digest in placeholders():
+        self._logger.info('Dropped placeholder frame for %s from %s.' %
             (self._metadata.identifier, self._metadata.source))
-        f.write(response.read())
+        return False
+
+      objectpath = object_path(digest)
+      os.makedirs(os.path.dirname(filepath), exist_ok=True)
+      os.makedirs(os.path.dirname(tmppath), exist_ok=True)
+      os.makedirs(os.path.dirname(objectpath), exist_ok=True)
+      if not os.path.exists(objectpath):
+        with open(tmppath, 'wb') as f:
+          f.write(data)
+        os.replace(tmppath, objectpath)
+      try:
+        link_frame(objectpath, filepath, tmppath)
+      except FileNotFoundError:
+        # The object was deleted as an orphan (see webcam.retention) after the
+        # check above; store the frame on its own.
+        with open(tmppath, 'wb') as f:
+          f.write(data)
+        os.replace(tmppath, filepath)
+      if self._thumbnails is not None:
+        self._write_thumbnails(data, os.path.basename(filepath))
+      self._logger.info('Succesfully saved frame for %s from %s.' %
+          (self._metadata.identifier, self._metadata.source))
       return True
     except Exception as error:
       self._logger.error('failed to save current frame for (%s, %s).' %
@@ -90,9 +207,29 @@ class Webcam(object):
       return False
 
 
+  def _write_thumbnails(self, data, filename):
+    """Writes the thumbnails of a stored frame.
+
+    Failures are logged; the frame itself is already stored.
+
+    Args:
+      data (bytes): The encoded frame.
+      filename (str): The name of the frame file.
+    """
+    camera = os.path.basename(os.path.dirname(self._frame_directory()))
+    try:
+      self._thumbnails.write(data, camera, filename)
+    except Exception as error:
+      self._logger.error('Failed to write thumbnails for (%s, %s).' %
+          (self._metadata.source, self._metadata.identifier))
+      self._logger.error(error)
+
+
   def frames(self):
     """An unsorted iterator for the filepaths for all the frames.
 
+    Every timestamp has its own path, even when frames share their bytes.
+
     Yields:
       string: The filename for the next frame chronologically.
     """